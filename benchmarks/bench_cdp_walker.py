@@ -0,0 +1,42 @@
+"""
+Benchmark the cellContent extraction engines against a fake CDP client with injected latency.
+
+Usage: python benchmarks/bench_cdp_walker.py [rows] [latency_ms]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tbm_stats import tbm_stats
+from fake_cdp import FakeCDPClient, make_report_columns
+
+
+async def run(rows: int, latency: float, max_in_flight: int, engine: str = 'walker'):
+    client = FakeCDPClient(make_report_columns(rows), latency=latency)
+    instance = tbm_stats()
+    instance.max_in_flight = max_in_flight
+    instance.extraction_engine = engine
+
+    start = time.perf_counter()
+    await instance.handle_debugger_paused(client, client.paused_payload())
+    elapsed = time.perf_counter() - start
+
+    return elapsed, client.calls, client.max_in_flight, len(instance.output)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 2.0) / 1000
+
+    print(f"rows={rows} latency={latency * 1000:.1f}ms")
+    print(f"{'engine':>10} {'in-flight':>10} {'seconds':>10} {'calls':>8} {'peak':>6} {'rows':>6}")
+    for engine, max_in_flight in [('walker', 1), ('walker', 4), ('walker', 16), ('walker', 64), ('serialize', 1)]:
+        elapsed, calls, peak, extracted = asyncio.run(run(rows, latency, max_in_flight, engine))
+        print(f"{engine:>10} {max_in_flight:>10} {elapsed:>10.3f} {calls:>8} {peak:>6} {extracted:>6}")
+
+
+if __name__ == '__main__':
+    main()
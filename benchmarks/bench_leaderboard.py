@@ -0,0 +1,88 @@
+"""
+Benchmark every stage of building the leaderboard on synthetic data, for both lookup formats.
+
+Each stage is timed once on its own and then run again under tracemalloc for its peak
+memory, so the tracing overhead doesn't skew the times. Data is seeded and reproducible.
+
+Usage: python benchmarks/bench_leaderboard.py [sizes] [formats]
+       python benchmarks/bench_leaderboard.py 1000,100000,1000000 1,2
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import utils
+from change_tracker import ChangeSet
+from leaderboard_index import LeaderboardIndex
+from results_schema import to_results_frame
+from synthetic import make_lookup, make_members, make_results
+
+
+def measure(stage):
+    """Return the stage's result, its wall time and its peak traced memory in bytes."""
+    start = time.perf_counter()
+    stage()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = stage()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+
+def changes_for(results, fraction: float = 0.01) -> ChangeSet:
+    """A ChangeSet touching the first `fraction` of the accounts, as if their balances moved."""
+    changed = results.iloc[:max(1, int(len(results) * fraction))]
+    return ChangeSet(added=[], changed=list(changed['AccountId']), removed=[], accounts=frozenset(changed['AccountName'].str.lower()))
+
+
+def run(accounts: int, lookup_format: int):
+    data = {}
+
+    def generate():
+        data['results'] = to_results_frame(make_results(accounts))
+        data['lookup'] = make_lookup(accounts, lookup_format)
+        data['members'] = make_members(accounts) if lookup_format == 1 else None
+
+    rows = []
+    rows.append(('generate',) + measure(generate)[1:])
+
+    results, lookup, members = data['results'], data['lookup'], data['members']
+    changes = changes_for(results)
+
+    index, *timing = measure(lambda: LeaderboardIndex(lookup, None, lookup_format=lookup_format))
+    rows.append(('index', *timing))
+    rows.append(('resolve_members', *measure(lambda: index.resolve_members(members))[1:]))
+    board, *timing = measure(lambda: index.rank(results))
+    rows.append(('rank', *timing))
+    rows.append(('rank 1% changed', *measure(lambda: index.rank(results, changes))[1:]))
+    rows.append(('format', *measure(lambda: index.format(board))[1:]))
+    rows.append(('format_chunks', *measure(lambda: index.format_chunks(board, 'Leaderboard'))[1:]))
+    top, *timing = measure(lambda: index.rank(results, top_n=100))
+    rows.append(('rank top 100', *timing))
+    rows.append(('format_chunks top 100', *measure(lambda: index.format_chunks(top, 'Leaderboard'))[1:]))
+    rows.append(('rank 1% changed top 100', *measure(lambda: index.rank(results, changes, top_n=100))[1:]))
+    rows.append(('generate_leaderboard', *measure(lambda: utils.generate_leaderboard(results, lookup, members, lookup_format))[1:]))
+    rows.append(('get_dataframe_hash', *measure(lambda: utils.get_dataframe_hash(results))[1:]))
+
+    return rows
+
+
+def main():
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else '1000,100000,1000000').split(',')]
+    formats = [int(f) for f in (sys.argv[2] if len(sys.argv) > 2 else '1,2').split(',')]
+
+    print(f"{'format':>6} {'accounts':>9} {'stage':>22} {'seconds':>9} {'peak MB':>9}")
+    for lookup_format in formats:
+        for accounts in sizes:
+            for stage, elapsed, peak in run(accounts, lookup_format):
+                print(f"{lookup_format:>6} {accounts:>9} {stage:>22} {elapsed:>9.3f} {peak / 2 ** 20:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark interpreter startup: module import times and the imports each CLI path needs.
+
+Every measurement runs in a fresh interpreter so nothing is already cached in sys.modules.
+
+Usage: python benchmarks/bench_startup.py [repeats]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODULES = ['pandas', 'pyppeteer', 'discord', 'pyarrow', 'tbm_stats', 'discord_bot', 'leaderboard_index', 'snapshot_store', 'main']
+
+# Modules each path has imported by the time it knows whether anything changed
+PATHS = {
+    'help': ['main'],
+    'check / no-op post': ['main', 'tbm_stats', 'change_tracker'],
+    'post': ['main', 'tbm_stats', 'change_tracker', 'lookup_cache', 'leaderboard_index', 'discord_bot', 'snapshot_store'],
+}
+
+
+def timed(args: list, repeats: int) -> float:
+    """Median wall time of running python with `args` from the repo root."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    baseline = timed(['-c', 'pass'], repeats)
+    print(f"interpreter: {baseline:.3f}s (subtracted below), median of {repeats}")
+
+    print(f"{'import':>20} {'seconds':>10}")
+    for module in MODULES:
+        print(f"{module:>20} {timed(['-c', f'import {module}'], repeats) - baseline:>10.3f}")
+
+    print(f"{'path':>20} {'seconds':>10}")
+    print(f"{'main.py --help':>20} {timed(['main.py', '--help'], repeats) - baseline:>10.3f}")
+    for path, modules in PATHS.items():
+        print(f"{path:>20} {timed(['-c', 'import ' + ', '.join(modules)], repeats) - baseline:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
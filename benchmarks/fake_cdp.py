@@ -0,0 +1,95 @@
+import asyncio
+import itertools
+
+
+class FakeCDPClient:
+    """
+    Minimal stand-in for a pyppeteer CDP session that serves a paused grid.
+
+    The fake holds a `this` object with a `cellContent` property laid out the same
+    way as the report: one object per column, each holding one array per cell.
+    Every `send` sleeps for `latency` seconds to simulate the round-trip to Chromium.
+    """
+
+    def __init__(self, columns: dict, latency: float = 0.005) -> None:
+        self.latency = latency
+        self.calls = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._ids = itertools.count(1)
+        self._objects = {}
+
+        cell_content = self._register({name: values for name, values in columns.items()})
+        self.this_id = self._register({'cellContent': cell_content})
+
+    def _register(self, value) -> str:
+        object_id = f"obj-{next(self._ids)}"
+        if isinstance(value, dict):
+            props = {name: self._wrap(child) for name, child in value.items()}
+        else:
+            props = {str(i): self._wrap(child) for i, child in enumerate(value)}
+            props['length'] = {'type': 'number', 'value': len(value)}
+        self._objects[object_id] = props
+        return object_id
+
+    def _wrap(self, value) -> dict:
+        if isinstance(value, str) and value.startswith('obj-') and value in self._objects:
+            return {'type': 'object', 'objectId': value}
+        if isinstance(value, (list, dict)):
+            return {'type': 'object', 'objectId': self._register(value)}
+        return {'type': type(value).__name__, 'value': value}
+
+    def _unwrap(self, value, depth):
+        if 'objectId' not in value:
+            return value.get('value')
+        if depth > 5:
+            return {}
+        return [self._unwrap(child, depth + 1) for child in self._objects[value['objectId']].values()]
+
+    def _serialize(self, this_id, keys):
+        """Python equivalent of tbm_stats.SERIALIZE_CELL_CONTENT."""
+        content = self._objects[self._objects[this_id]['cellContent']['objectId']]
+        columns = {}
+        for key in (keys or content.keys()):
+            if 'objectId' not in content.get(key, {}):
+                continue
+            values = []
+            for cell in self._objects[content[key]['objectId']].values():
+                if 'objectId' not in cell:
+                    continue
+                props = list(self._objects[cell['objectId']].values())
+                values.append(self._unwrap(props[0], 2) if props else None)
+            columns[key] = values
+        return columns
+
+    def paused_payload(self) -> dict:
+        return {'callFrames': [{'this': {'objectId': self.this_id}}]}
+
+    async def send(self, method: str, params: dict = None) -> dict:
+        params = params or {}
+        self.calls += 1
+        self._in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self._in_flight -= 1
+
+        if method == 'Runtime.getProperties':
+            props = self._objects.get(params['objectId'], {})
+            return {'result': [{'name': name, 'value': value} for name, value in props.items()]}
+        if method == 'Runtime.callFunctionOn':
+            return {'result': {'type': 'object', 'value': self._serialize(params['objectId'], params['arguments'][0]['value'])}}
+        if method == 'Runtime.releaseObject':
+            self._objects.pop(params['objectId'], None)
+        return {}
+
+
+def make_report_columns(rows: int) -> dict:
+    """Build cellContent columns for `rows` accounts using the report's internal keys."""
+    return {
+        "inode-1qhQxZHBcWEVjKLrwXgiXq/CREATED_AT": [[f"2023-09-{(i % 28) + 1:02d}"] for i in range(rows)],
+        "inode-1qhQxZHBcWEVjKLrwXgiXq/ACCOUNT_ID": [[str(100000 + i)] for i in range(rows)],
+        "inode-1qhQxZHBcWEVjKLrwXgiXq/ACCOUNT_NAME": [[f"EXPRESS{i:06d}"] for i in range(rows)],
+        "c6S8DJZnu2": [["${:,.2f}".format(50000 + (i % 500) * 7.25)] for i in range(rows)],
+    }
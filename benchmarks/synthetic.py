@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+
+def account_names(prefix: str, ids: np.ndarray) -> np.ndarray:
+    """Names such as "EXPRESS000042", zero padded to six digits."""
+    if len(ids) == 0:
+        return np.array([], dtype=object)
+    return np.char.add(prefix, np.char.zfill(ids.astype(str), 6)).astype(object)
+
+
+def format_balances(cents: np.ndarray) -> np.ndarray:
+    """Format non-negative int cents below $1bn like "${:,.2f}", without a Python loop."""
+    dollars, cents = np.divmod(cents, 100)
+    millions, rest = np.divmod(dollars, 1000000)
+    thousands, units = np.divmod(rest, 1000)
+
+    def group(values, width):
+        return np.char.zfill(values.astype(str), width)
+
+    text = np.where(millions > 0, np.char.add(np.char.add(millions.astype(str), ','), group(thousands, 3)), thousands.astype(str))
+    text = np.where(dollars >= 1000, np.char.add(np.char.add(text, ','), group(units, 3)), units.astype(str))
+    return np.char.add(np.char.add(np.char.add('$', text), '.'), group(cents, 2)).astype(object)
+
+
+def make_results(accounts: int, seed: int = 0) -> pd.DataFrame:
+    """Scraped results for `accounts` accounts, Balance as the report's "$49,123.45" strings."""
+    rng = np.random.default_rng(seed)
+    ids = np.arange(accounts)
+    created = np.datetime64('2023-08-01') + rng.integers(0, 61 * 86400, accounts).astype('timedelta64[s]')
+
+    return pd.DataFrame({
+        'CreatedAt': created,
+        'AccountId': 100000 + ids,
+        'AccountName': account_names('EXPRESS', ids),
+        'Balance': format_balances(rng.integers(4500000, 5500000, accounts))
+    })
+
+
+def make_lookup(accounts: int, lookup_format: int = 1, seed: int = 0) -> pd.DataFrame:
+    """
+    Lookup sheet referencing the accounts from make_results, as LookupCache returns it.
+
+    About 5% of rows name an account that wasn't scraped and 20% add an express account.
+    Format 1 has no header: account, username, express account. Format 2 is the exploded
+    sheet with Accounts, ExpressAccountName and User ID ('0' for members without one).
+    """
+    rng = np.random.default_rng(seed + 1)
+    ids = rng.permutation(accounts)
+    names = account_names('EXPRESS', ids)
+    missing = rng.random(accounts) < 0.05
+    names[missing] = account_names('MISSING', ids[missing])
+
+    express = np.full(accounts, np.nan, dtype=object)
+    with_express = rng.random(accounts) < 0.2
+    express[with_express] = account_names('EXPRESS', rng.integers(0, accounts, with_express.sum()))
+
+    if lookup_format == 1:
+        return pd.DataFrame({0: names, 1: account_names('user', ids), 2: express})
+
+    user_ids = (10 ** 17 + ids).astype(str).astype(object)
+    user_ids[rng.random(accounts) < 0.1] = '0'
+    return pd.DataFrame({'Accounts': names, 'ExpressAccountName': express, 'User ID': user_ids})
+
+
+def make_members(accounts: int, seed: int = 0) -> pd.DataFrame:
+    """Discord members for about 80% of the lookup usernames, as MemberDirectory.find returns them."""
+    rng = np.random.default_rng(seed + 2)
+    ids = np.flatnonzero(rng.random(accounts) < 0.8)
+
+    return pd.DataFrame({
+        'id': 10 ** 17 + ids,
+        'name': account_names('user', ids),
+        'global_name': account_names('User ', ids),
+        'nick': None,
+        'guild_id': 1
+    })
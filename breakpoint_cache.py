@@ -0,0 +1,71 @@
+import json
+import os
+
+
+class BreakpointCache:
+    """
+    Persistent map of script URL -> resolved breakpoint location.
+
+    Each entry records the V8 content hash reported by Debugger.scriptParsed, so a
+    location is only reused while the bundle is unchanged. Scripts that were searched
+    and did not contain the target are stored with a location of None so they are
+    not searched again either.
+
+    Entries also count, per report page, the runs in a row that didn't parse the
+    script. Only scripts parsed in a page's last run are placed before it navigates,
+    and entries no page has parsed for `max_missed` runs are evicted, so rebuilt
+    bundles with new URLs don't pile up.
+    """
+
+    def __init__(self, filename: str, max_missed: int = 3) -> None:
+        self.filename = filename
+        self.max_missed = max_missed
+        self.entries = {}
+
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"INFO: Ignoring unreadable breakpoint cache {filename}: {e}")
+
+    def get(self, url: str, script_hash: str):
+        """Return the cached entry for `url` if it was stored for the same content hash."""
+        entry = self.entries.get(url)
+        if entry and entry.get('hash') == script_hash:
+            return entry
+        return None
+
+    def locations(self, target: str) -> dict:
+        """Return {url: {'line': .., 'col': ..}} for scripts containing the target that `target`'s last run parsed."""
+        return {url: entry['location'] for url, entry in self.entries.items()
+                if entry.get('location') and entry.get('missed', {}).get(target) == 0}
+
+    def store(self, url: str, script_hash: str, location) -> None:
+        missed = self.entries.get(url, {}).get('missed', {})
+        self.entries[url] = {'hash': script_hash, 'location': location, 'missed': missed}
+        self.save()
+
+    def record_run(self, target: str, parsed_urls) -> None:
+        """Count a completed run of the `target` page that parsed `parsed_urls`, evicting entries nobody parses anymore."""
+        for url in list(self.entries):
+            missed = self.entries[url].setdefault('missed', {})
+            if url in parsed_urls:
+                missed[target] = 0
+            elif target in missed:
+                missed[target] += 1
+                if missed[target] >= self.max_missed:
+                    del missed[target]
+            if not missed:
+                del self.entries[url]
+        self.save()
+
+    def remove(self, url: str) -> None:
+        if self.entries.pop(url, None) is not None:
+            self.save()
+
+    def save(self) -> None:
+        if not self.filename:
+            return
+        with open(self.filename, 'w') as f:
+            json.dump(self.entries, f, indent=2)
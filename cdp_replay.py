@@ -0,0 +1,268 @@
+"""
+Record a scraper's CDP session to a file and replay it without a browser.
+
+Set CDP_RECORD_FILE to record the next session: every command with its response
+and latency, every event and every navigation is written as one JSON line with
+its time since the session opened. Set CDP_REPLAY_FILE to have tbm_stats use a
+ReplayBrowser instead of launching Chromium. Commands are answered from the
+recording and the events that followed each navigation are emitted again, at the
+recorded times multiplied by CDP_REPLAY_SCALE (1 = original timing, 0 = as fast
+as possible).
+
+Replay with the breakpoint cache in the state it was in while recording, so the
+scraper sends the same commands.
+
+Usage: python cdp_replay.py <recording.jsonl> [scale]
+       python -m cProfile -s cumtime cdp_replay.py <recording.jsonl> 0
+"""
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict, deque
+from pyppeteer import errors
+
+
+def command_key(method: str, params: dict) -> str:
+    return method + json.dumps(params or {}, sort_keys=True)
+
+
+class CDPRecorder:
+    """Writes the commands, events and navigations of one CDP session and its page to a JSONL file."""
+
+    def __init__(self, filename: str) -> None:
+        self.file = open(filename, 'w')
+        self.start = time.monotonic()
+
+    def now(self) -> float:
+        return time.monotonic() - self.start
+
+    def write(self, record: dict) -> None:
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+
+    def wrap(self, client) -> None:
+        """Record everything sent and received through `client` from now on."""
+        send, emit = client.send, client.emit
+
+        async def recording_send(method, params=None):
+            started = self.now()
+            try:
+                result = await send(method, params)
+            except Exception as e:
+                self.write({'type': 'command', 't': started, 'duration': self.now() - started,
+                            'method': method, 'params': params or {}, 'error': str(e)})
+                raise
+            self.write({'type': 'command', 't': started, 'duration': self.now() - started,
+                        'method': method, 'params': params or {}, 'result': result})
+            return result
+
+        def recording_emit(event, *args, **kwargs):
+            if isinstance(event, str) and '.' in event:
+                self.write({'type': 'event', 't': self.now(), 'method': event, 'params': args[0] if args else {}})
+            return emit(event, *args, **kwargs)
+
+        client.send = recording_send
+        client.emit = recording_emit
+
+    def wrap_page(self, page) -> None:
+        """Record navigations, which replay uses to time events, and page.evaluate results."""
+        goto, reload, evaluate = page.goto, page.reload, page.evaluate
+
+        async def navigate(action, call, *args, **kwargs):
+            started = self.now()
+            self.write({'type': 'navigate', 't': started, 'action': action})
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                self.write({'type': 'navigated', 't': self.now(), 'duration': self.now() - started})
+
+        async def recording_evaluate(*args, **kwargs):
+            result = await evaluate(*args, **kwargs)
+            self.write({'type': 'evaluate', 't': self.now(), 'result': result})
+            return result
+
+        page.goto = lambda *args, **kwargs: navigate('goto', goto, *args, **kwargs)
+        page.reload = lambda *args, **kwargs: navigate('reload', reload, *args, **kwargs)
+        page.evaluate = recording_evaluate
+
+
+class ReplayConnection:
+    """
+    Stand-in for a CDP session that answers commands from a recording.
+
+    A command is answered with the next recorded response for the same method and
+    params, or failing that the next one for the same method, after its recorded
+    latency. Commands never recorded raise a NetworkError.
+    """
+
+    def __init__(self, records: list, time_scale: float = 1.0) -> None:
+        self.time_scale = time_scale
+        self.handlers = defaultdict(list)
+        self.by_key = defaultdict(deque)
+        self.by_method = defaultdict(deque)
+        self.calls = 0
+
+        for record in records:
+            if record['type'] == 'command':
+                self.by_key[command_key(record['method'], record['params'])].append(record)
+                self.by_method[record['method']].append(record)
+
+    def on(self, event: str, handler) -> None:
+        self.handlers[event].append(handler)
+
+    def emit(self, event: str, payload: dict) -> None:
+        for handler in list(self.handlers[event]):
+            handler(payload)
+
+    def _take(self, method: str, params: dict) -> dict:
+        for queue in (self.by_key[command_key(method, params)], self.by_method[method]):
+            while queue:
+                record = queue.popleft()
+                if not record.get('used'):
+                    record['used'] = True
+                    return record
+        return None
+
+    async def send(self, method: str, params: dict = None) -> dict:
+        self.calls += 1
+        record = self._take(method, params)
+        if record is None:
+            raise errors.NetworkError(f"Protocol error ({method}): not in the recording")
+
+        await asyncio.sleep(record['duration'] * self.time_scale)
+        if 'error' in record:
+            raise errors.NetworkError(record['error'])
+        return record['result']
+
+
+class _Target:
+    def __init__(self, page) -> None:
+        self.page = page
+
+    async def createCDPSession(self) -> ReplayConnection:
+        return self.page.connection
+
+
+class _PageClient:
+    """The page's own session, only used for setup commands that don't matter to the replay."""
+
+    async def send(self, method: str, params: dict = None) -> dict:
+        return {}
+
+
+class ReplayPage:
+    """
+    Stand-in for a pyppeteer Page.
+
+    Each goto or reload replays the events recorded after the matching navigation,
+    in order and at their recorded offsets, while taking the navigation's recorded
+    time itself. Events recorded before the first navigation play as soon as the
+    page is created.
+    """
+
+    def __init__(self, records: list, time_scale: float = 1.0) -> None:
+        self.time_scale = time_scale
+        self.connection = ReplayConnection(records, time_scale)
+        self.target = _Target(self)
+        self._client = _PageClient()
+        self.evaluations = deque(record['result'] for record in records if record['type'] == 'evaluate')
+        self.navigations = deque()
+        self.players = []
+
+        segment, started, duration = [], 0.0, 0.0
+        for record in records:
+            if record['type'] == 'navigate':
+                self.navigations.append((started, duration, segment))
+                segment, started = [], record['t']
+            elif record['type'] == 'navigated':
+                duration = record['duration']
+            elif record['type'] == 'event':
+                segment.append(record)
+        self.navigations.append((started, duration, segment))
+
+        # Events before the first navigation, such as scripts parsed on about:blank
+        self._play(*self.navigations.popleft())
+
+    def _play(self, started: float, duration: float, events: list) -> float:
+        async def play():
+            elapsed = 0.0
+            for event in events:
+                offset = event['t'] - started
+                await asyncio.sleep(max(0.0, offset - elapsed) * self.time_scale)
+                elapsed = max(elapsed, offset)
+                self.connection.emit(event['method'], event['params'])
+
+        self.players.append(asyncio.ensure_future(play()))
+        return duration
+
+    async def _navigate(self):
+        if not self.navigations:
+            raise errors.PageError('No more navigations in the recording')
+        await asyncio.sleep(self._play(*self.navigations.popleft()) * self.time_scale)
+
+    async def goto(self, url: str, *args, **kwargs):
+        await self._navigate()
+
+    async def reload(self, *args, **kwargs):
+        await self._navigate()
+
+    async def evaluate(self, *args, **kwargs):
+        return self.evaluations.popleft() if self.evaluations else False
+
+    def on(self, event: str, handler) -> None:
+        pass
+
+    async def setViewport(self, viewport: dict) -> None:
+        pass
+
+    async def setJavaScriptEnabled(self, enabled: bool) -> None:
+        pass
+
+    async def close(self) -> None:
+        for player in self.players:
+            player.cancel()
+
+
+class ReplayBrowser:
+    """Stand-in for a pyppeteer Browser whose pages replay one recording."""
+
+    def __init__(self, records: list, time_scale: float = 1.0) -> None:
+        self.records = records
+        self.time_scale = time_scale
+        self.pages = []
+
+    @classmethod
+    def load(cls, filename: str, time_scale: float = 1.0) -> 'ReplayBrowser':
+        with open(filename, 'r') as f:
+            return cls([json.loads(line) for line in f if line.strip()], time_scale)
+
+    async def newPage(self) -> ReplayPage:
+        page = ReplayPage(self.records, self.time_scale)
+        self.pages.append(page)
+        return page
+
+    def on(self, event: str, handler) -> None:
+        pass
+
+    async def close(self) -> None:
+        for page in self.pages:
+            await page.close()
+
+
+if __name__ == '__main__':
+    from tbm_stats import tbm_stats
+
+    instance = tbm_stats()
+    instance.cdp_record_file = None
+    instance.cdp_replay_file = sys.argv[1]
+    instance.cdp_replay_scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+
+    start = time.perf_counter()
+    res = instance.get_results()
+    print(res)
+    print(f"Replayed in {time.perf_counter() - start:.3f}s")
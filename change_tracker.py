@@ -0,0 +1,90 @@
+import json
+import sqlite3
+from typing import NamedTuple
+import pandas as pd
+
+
+class ChangeSet(NamedTuple):
+    """AccountIds added, changed and removed since the last commit, plus the lower cased account names involved."""
+    added: list
+    changed: list
+    removed: list
+    accounts: frozenset
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def __str__(self) -> str:
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed"
+
+
+class RowHashStore:
+    """
+    Per-account row hashes kept in SQLite.
+
+    Replaces the single whole-frame hash that was kept in HASH_FILE: `diff` reports exactly which
+    accounts were added, changed or removed since the last `commit`, and the last
+    posted ranking is kept alongside so callers can skip posting when no rank moved.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS rows (account_id TEXT PRIMARY KEY, account_name TEXT, row_hash INTEGER)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    @staticmethod
+    def row_hashes(df: pd.DataFrame) -> pd.DataFrame:
+        """Return account_id, account_name and a signed 64 bit hash of every row."""
+        return pd.DataFrame({
+            'account_id': df['AccountId'].astype(str).to_numpy(),
+            'account_name': df['AccountName'].astype(str).to_numpy(),
+            'row_hash': pd.util.hash_pandas_object(df, index=False).to_numpy().view('int64')
+        }).drop_duplicates('account_id', keep='last')
+
+    def _saved(self) -> pd.DataFrame:
+        return pd.read_sql_query('SELECT account_id, account_name, row_hash FROM rows', self.conn)
+
+    def diff(self, df: pd.DataFrame) -> ChangeSet:
+        """Compare `df` with the committed rows."""
+        current = self.row_hashes(df).set_index('account_id')
+        saved = self._saved().set_index('account_id')
+
+        added = current.index.difference(saved.index)
+        removed = saved.index.difference(current.index)
+        common = current.index.intersection(saved.index)
+        changed = common[current.loc[common, 'row_hash'].to_numpy() != saved.loc[common, 'row_hash'].to_numpy()]
+
+        names = pd.concat([
+            current.loc[added.union(changed), 'account_name'],
+            saved.loc[removed.union(changed), 'account_name']
+        ])
+
+        return ChangeSet(
+            added=list(added),
+            changed=list(changed),
+            removed=list(removed),
+            accounts=frozenset(names.str.lower())
+        )
+
+    def commit(self, df: pd.DataFrame) -> None:
+        """Replace the committed rows with `df`."""
+        current = self.row_hashes(df)
+        with self.conn:
+            self.conn.execute('DELETE FROM rows')
+            self.conn.executemany('INSERT INTO rows VALUES (?, ?, ?)', current.itertuples(index=False, name=None))
+
+    def load_ranking(self, key: str = 'ranking') -> list:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def save_ranking(self, ranking: list, key: str = 'ranking') -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(ranking)))
+
+    def rank_changed(self, ranking: list, key: str = 'ranking') -> bool:
+        """True if `ranking` differs from the last ranking saved under `key`, one per leaderboard."""
+        return ranking != self.load_ranking(key)
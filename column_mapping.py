@@ -0,0 +1,119 @@
+import json
+import os
+import re
+
+# Header labels (lower case, alphanumerics only) that identify each of our columns
+LABELS = {
+    'CreatedAt': {'createdat', 'created', 'createddate', 'creationdate'},
+    'AccountId': {'accountid', 'id'},
+    'AccountName': {'accountname', 'account', 'name'},
+    'Balance': {'balance', 'accountbalance', 'currentbalance'}
+}
+
+# Value shapes, tried in this order for columns whose label didn't match
+SHAPES = {
+    'Balance': re.compile(r'^\$?-?\$?[\d,]+\.\d{2}$'),
+    'CreatedAt': re.compile(r'^\d{4}-\d{2}-\d{2}([ T].*)?$'),
+    'AccountId': re.compile(r'^\d+$'),
+    'AccountName': re.compile(r'^(?=.*[A-Za-z])(?=.*\d)[\w-]+$')
+}
+
+# Share of a column's non-empty values that must have the shape
+SHAPE_THRESHOLD = 0.8
+
+
+def load_column_mapping(default: dict) -> dict:
+    """COLUMN_MAPPING as a JSON object or the path of a JSON file, else `default`."""
+    value = os.getenv('COLUMN_MAPPING', '').strip()
+    if not value:
+        return dict(default)
+    if value.startswith('{'):
+        return json.loads(value)
+    with open(value, 'r') as f:
+        return json.load(f)
+
+
+def header_label(key: str) -> str:
+    """Label part of a report column key, e.g. "inode-xyz/ACCOUNT_ID" -> "accountid"."""
+    return re.sub(r'[^a-z0-9]', '', key.rsplit('/', 1)[-1].lower())
+
+
+class ColumnMapping:
+    """
+    Report column key -> our column name, rediscovered when the report's keys change.
+
+    Starts from the configured mapping. When an extraction is missing any of the mapped
+    keys, `discover` matches every column in it to ours, first by header label and then
+    by the shape of its values. A complete result is used from then on and saved to
+    `filename` together with the configured mapping it replaced, so it is only reused
+    while that configuration is unchanged.
+    """
+
+    def __init__(self, configured: dict, filename: str) -> None:
+        self.configured = configured
+        self.filename = filename
+        self.mapping = dict(configured)
+
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    cached = json.load(f)
+                if cached.get('configured') == configured:
+                    self.mapping = cached['mapping']
+            except (OSError, ValueError, KeyError) as e:
+                print(f"INFO: Ignoring unreadable column mapping cache {filename}: {e}")
+
+    def missing(self, data: dict) -> list:
+        """Mapped keys that aren't in an extraction."""
+        return [key for key in self.mapping if key not in data]
+
+    @staticmethod
+    def values(column, columnar: bool) -> list:
+        """Non-empty cell values as strings, from walker output (cells are property lists) or columnar output."""
+        if not columnar:
+            column = [cell[0] if isinstance(cell, list) and cell else None for cell in column]
+        return [str(value) for value in column if value not in (None, '', 'null') and not isinstance(value, (list, dict))]
+
+    def discover(self, data: dict, columnar: bool = False) -> bool:
+        """Find our columns among every column of one extraction. Returns True if all were found."""
+        columns = {key: self.values(column, columnar) for key, column in data.items() if isinstance(column, list)}
+        found = {}
+
+        for target, labels in LABELS.items():
+            for key in columns:
+                if key not in found and header_label(key) in labels and columns[key]:
+                    found[key] = target
+                    break
+
+        for target, shape in SHAPES.items():
+            if target in found.values():
+                continue
+            best, best_score = None, SHAPE_THRESHOLD
+            for key, values in columns.items():
+                if key in found or not values:
+                    continue
+                score = sum(1 for value in values if shape.match(value)) / len(values)
+                if score >= best_score and (best is None or score > best_score):
+                    best, best_score = key, score
+            if best is not None:
+                found[best] = target
+
+        required = set(self.configured.values()) & set(LABELS)
+        if not required <= set(found.values()):
+            print(f"Column discovery only matched {sorted(found.values())} from {len(columns)} columns")
+            return False
+
+        # Configured columns discovery doesn't know about keep their keys, and the frame keeps its column order
+        found.update({key: name for key, name in self.mapping.items() if name not in LABELS})
+        order = list(self.configured.values())
+        found = dict(sorted(found.items(), key=lambda item: order.index(item[1]) if item[1] in order else len(order)))
+        print(f"Report columns changed, using discovered mapping: {found}")
+        self.mapping = found
+        self.save()
+        return True
+
+    def save(self) -> None:
+        if not self.filename:
+            return
+        with open(self.filename, 'w') as f:
+            json.dump({'configured': self.configured, 'mapping': self.mapping}, f, indent=2)
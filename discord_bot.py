@@ -1,90 +1,278 @@
+import asyncio
+import json
 import os
 import threading
 import discord
+import pandas as pd
 import time
+from typing import NamedTuple
 from discord.ext import commands
 from dotenv import load_dotenv
+from member_directory import MemberDirectory, normalize_name
+from metrics import metrics
+
+
+class ChunkResult(NamedTuple):
+    """Outcome of sending or editing one chunk of a message."""
+    index: int
+    message: discord.Message
+    error: Exception
+
+
+class DeliveryError(Exception):
+    """One or more chunks of a message could not be delivered."""
+
+    def __init__(self, results: list) -> None:
+        self.results = results
+        failed = [result for result in results if result.error is not None]
+        super().__init__(f"{len(failed)} of {len(results)} chunks failed: " + "; ".join(f"#{r.index}: {r.error}" for r in failed))
+
+
+def split_message(message: str, max_len: int = 2000) -> list:
+    """Split a message on line boundaries into chunks Discord will accept."""
+    lines = message.split("\n")
+    chunks = []
+    current_chunk = ""
+
+    for line in lines:
+        if len(current_chunk) + len(line) + 1 > max_len:  # +1 for the newline character
+            chunks.append(current_chunk)
+            current_chunk = line + "\n"
+        else:
+            current_chunk += line + "\n"
+
+    if current_chunk:
+        chunks.append(current_chunk)
+
+    return chunks
 
-load_dotenv()
 
 class DiscordBot(commands.Bot):
     def __init__(self):
         self.channel = None
+        self.thread = None
+        # Every API call that posts, edits or deletes goes through this queue, one at a time
+        self.send_queue = None
+        self.max_retries = int(os.getenv('DISCORD_MAX_RETRIES', 5))
+        # Where the ids of the last posted leaderboard are kept for editing in place
+        self.message_file = os.getenv('LEADERBOARD_MESSAGE_FILE', 'leaderboard_message.json')
+        # Set once the bot has connected and found its channel
+        self.ready_event = asyncio.Event()
+        # Cached members, kept current from member events instead of a full download at startup
+        self.directory = MemberDirectory(os.getenv('MEMBER_DIRECTORY_DB', 'members.sqlite'),
+                                         hit_ttl=float(os.getenv('MEMBER_DIRECTORY_TTL', 604800)))
+        # Stale members looked up again per resolve, so a cold cache doesn't stall a run
+        self.member_refresh_limit = int(os.getenv('MEMBER_REFRESH_LIMIT', 50))
         intents = discord.Intents.default()
         intents.members = True
-        super().__init__(command_prefix="!", intents=intents)
+        super().__init__(command_prefix="!", intents=intents, chunk_guilds_at_startup=False)
 
     async def on_ready(self):
-        self.channel = self.get_channel(int(os.getenv('DISCORD_CHANNEL')))
+        # Leaderboard jobs name their own channels, DISCORD_CHANNEL is only the default
+        if os.getenv('DISCORD_CHANNEL'):
+            self.channel = self.get_channel(int(os.getenv('DISCORD_CHANNEL')))
         print(f"Bot {self.user.display_name} is connected to server. Channel is {self.channel}")
+        self.ready_event.set()
 
-    def send_message(self, message):
-        max_len = 2000
-        lines = message.split("\n")
-        chunks = []
-        current_chunk = ""
+    async def on_member_join(self, member):
+        self.directory.upsert(member)
 
-        for line in lines:
-            if len(current_chunk) + len(line) + 1 > max_len:  # +1 for the newline character
-                chunks.append(current_chunk)
-                current_chunk = line + "\n"
-            else:
-                current_chunk += line + "\n"
+    async def on_member_update(self, before, after):
+        self.directory.upsert(after)
 
-        if current_chunk:
-            chunks.append(current_chunk)
+    async def on_user_update(self, before, after):
+        # Username changes come as user updates, not member updates
+        self.directory.update_user(after)
+
+    async def on_member_remove(self, member):
+        self.directory.remove(member.guild.id, member.id)
+
+    async def resolve_members_async(self, usernames, channel_id: int = None) -> pd.DataFrame:
+        """
+        Return id, name, global_name and nick for the given usernames.
+
+        Names missing from the directory are looked up with a gateway member query
+        in the guild of `channel_id` (default DISCORD_CHANNEL) and cached, so only
+        unknown names cost a request. Up to MEMBER_REFRESH_LIMIT names whose members
+        are stale are looked up again, dropping members that left or were renamed.
+        """
+        guild = (self.get_channel(channel_id) if channel_id else self.channel).guild
+        name_keys = set(filter(None, (normalize_name(name) for name in usernames)))
+        missing = self.directory.unresolved(name_keys, guild.id)
+        stale = self.directory.stale(name_keys - missing, guild.id, self.member_refresh_limit)
+
+        if missing or stale:
+            print(f"Looking up {len(missing)} members not in {guild} and {len(stale)} stale..")
+            for name_key in list(missing) + stale:
+                try:
+                    members = await guild.query_members(query=name_key, limit=10)
+                except (asyncio.TimeoutError, discord.ClientException) as e:
+                    print(f"Failed to look up member {name_key}: {e}")
+                    continue
+                # A full page of prefix matches may not include every exact match
+                if len(members) < 10:
+                    self.directory.forget(name_key, guild.id)
+                for member in members:
+                    self.directory.upsert(member)
+            self.directory.record_misses(self.directory.unresolved(missing | set(stale), guild.id), guild.id)
 
-        self.channel = self.get_channel(int(os.getenv('DISCORD_CHANNEL')))
+        return self.directory.find(name_keys, guild.id)
 
-        self._send_chunks_sequentially(chunks)
+    def resolve_members(self, usernames, channel_id: int = None, timeout: float = None) -> pd.DataFrame:
+        """Resolve usernames from another thread, see resolve_members_async."""
+        future = asyncio.run_coroutine_threadsafe(self.resolve_members_async(usernames, channel_id), self.loop)
+        return future.result(timeout)
 
-    def _send_single_chunk(self, chunk, remaining_chunks):
-        def callback(task):
-            if remaining_chunks:
-                next_chunk = remaining_chunks.pop(0)
-                self._send_single_chunk(next_chunk, remaining_chunks)
+    def _retry_after(self, error: discord.HTTPException) -> float:
+        headers = getattr(error.response, 'headers', {}) or {}
+        return float(headers.get('Retry-After') or headers.get('X-RateLimit-Reset-After') or 1)
 
-        task = self.loop.create_task(self.channel.send(chunk))
-        task.add_done_callback(callback)
+    async def _send_worker(self):
+        while True:
+            operation, future = await self.send_queue.get()
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = await operation()
+                except discord.HTTPException as e:
+                    if e.status == 429 and attempt < self.max_retries:
+                        delay = self._retry_after(e)
+                        print(f"Rate limited by Discord, retrying in {delay:.2f}s")
+                        metrics.count('discord_rate_limited')
+                        await asyncio.sleep(delay)
+                        continue
+                    if not future.done():
+                        future.set_exception(e)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                break
+            self.send_queue.task_done()
 
-    def _send_chunks_sequentially(self, chunks):
-        if chunks:
-            first_chunk = chunks.pop(0)
-            self._send_single_chunk(first_chunk, chunks)
+    async def _deliver(self, operation):
+        """Queue one Discord API call and wait for its result."""
+        if self.send_queue is None:
+            self.send_queue = asyncio.Queue()
+            asyncio.ensure_future(self._send_worker())
 
+        future = asyncio.get_event_loop().create_future()
+        await self.send_queue.put((operation, future))
+        return await future
+
+    def _load_message_ids(self, channel_id: int) -> list:
+        if not os.path.exists(self.message_file):
+            return []
+        try:
+            with open(self.message_file, 'r') as f:
+                return json.load(f).get(str(channel_id), [])
+        except (OSError, ValueError):
+            return []
+
+    def _save_message_ids(self, channel_id: int, ids: list) -> None:
+        saved = {}
+        if os.path.exists(self.message_file):
+            try:
+                with open(self.message_file, 'r') as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                saved = {}
+        saved[str(channel_id)] = ids
+        with open(self.message_file, 'w') as f:
+            json.dump(saved, f)
+
+    async def _send_or_edit(self, channel, chunk: str, message_id):
+        if message_id is not None:
+            try:
+                message = await self._deliver(lambda: channel.fetch_message(message_id))
+                return await self._deliver(lambda: message.edit(content=chunk))
+            except discord.NotFound:
+                pass
+        return await self._deliver(lambda: channel.send(chunk))
+
+    async def send_message_async(self, message, edit: bool = False, channel_id: int = None) -> list:
+        """
+        Send (or with edit=True, edit the previously posted) message, one chunk at a time.
+
+        `message` is either a string, split on line boundaries to fit Discord's limit,
+        or a list of already sized chunks such as LeaderboardIndex.format_chunks returns.
+
+        Returns a ChunkResult per chunk once every chunk has been acknowledged.
+        Raises DeliveryError if any chunk failed.
+        """
+        channel_id = channel_id or int(os.getenv('DISCORD_CHANNEL'))
+        channel = self.get_channel(channel_id)
+        chunks = split_message(message) if isinstance(message, str) else list(message)
+        previous = self._load_message_ids(channel_id) if edit else []
+
+        results = []
+        with metrics.span('discord_send'):
+            for index, chunk in enumerate(chunks):
+                message_id = previous[index] if index < len(previous) else None
+                try:
+                    sent = await self._send_or_edit(channel, chunk, message_id)
+                    results.append(ChunkResult(index, sent, None))
+                    metrics.count('chunks_sent')
+                except Exception as e:
+                    print(f"Failed to deliver chunk {index}: {e}")
+                    results.append(ChunkResult(index, None, e))
+                    metrics.count('chunks_failed')
+
+        # The new leaderboard is shorter than the old one, remove the leftover messages
+        for message_id in previous[len(chunks):]:
+            try:
+                message = await self._deliver(lambda: channel.fetch_message(message_id))
+                await self._deliver(message.delete)
+            except discord.HTTPException as e:
+                print(f"Failed to delete old message {message_id}: {e}")
+
+        self._save_message_ids(channel_id, [result.message.id for result in results if result.message is not None])
+
+        if any(result.error is not None for result in results):
+            raise DeliveryError(results)
+
+        return results
+
+    def send_message(self, message, edit: bool = False, channel_id: int = None, timeout: float = None):
+        """Send from another thread and block until every chunk is delivered."""
+        future = asyncio.run_coroutine_threadsafe(self.send_message_async(message, edit=edit, channel_id=channel_id), self.loop)
+        return future.result(timeout)
 
     def get_channel_members(self):
         return self.channel.members
-    
+
     def is_channel_available(self):
         return self.channel is not None
 
     def run_bot(self):
-        t = threading.Thread(target=self.run, args=[os.getenv('DISCORD_TOKEN')])
-        t.start()
+        self.thread = threading.Thread(target=self.run, args=[os.getenv('DISCORD_TOKEN')])
+        self.thread.start()
 
     def stop_bot(self):
-        self.loop.create_task(self.close())
+        """Close the connection and wait for the bot thread to finish."""
+        if self.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
 
 
 if __name__ == "__main__":
+    load_dotenv()
     instance = DiscordBot()
-    
+
     instance.run_bot()
 
     print('hello')
 
-    time.sleep(10)
+    while not instance.is_ready():
+        time.sleep(1)
 
     instance.send_message('does it work now?')
 
     members = instance.get_channel_members()
 
-
     print(members)
-    time.sleep(10)
 
     instance.stop_bot()
-
-    instance.get
- 
\ No newline at end of file
@@ -0,0 +1,315 @@
+import numpy as np
+import pandas as pd
+from results_schema import parse_balance
+
+START_BALANCE = 50000.0
+
+# Lookup account name used for members who didn't start with a combine
+DUMMY_ACCOUNT = 'dummy'
+
+MEDALS = {1: ':first_place:', 2: ':second_place:', 3: ':third_place:'}
+
+
+def format_money(values: np.ndarray) -> np.ndarray:
+    """Format floats like "${:,.2f}" (so -1234.5 is "$-1,234.50"), without a Python loop."""
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return np.array([], dtype=object)
+    dollars, cents = np.divmod(np.round(np.abs(values) * 100).astype('int64'), 100)
+
+    # Thousands groups from the most significant down, zero padded after the first
+    text = np.full(len(values), '', dtype=object)
+    groups = int(np.log10(max(dollars.max(initial=0), 1)) // 3) + 1
+    for group in range(groups - 1, -1, -1):
+        digits = ((dollars // 1000 ** group) % 1000).astype(str)
+        started = text != ''
+        piece = np.where(started, np.char.add(',', np.char.zfill(digits, 3)), digits)
+        present = (dollars >= 1000 ** group) | (group == 0)
+        text = np.where(present, np.char.add(text.astype(str), piece), text)
+
+    sign = np.where(np.signbit(values), '$-', '$')
+    return np.char.add(np.char.add(np.char.add(sign, text.astype(str)), '.'), np.char.zfill(cents.astype(str), 2)).astype(object)
+
+
+def split_lines(lines: list, max_len: int = 2000) -> list:
+    """Pack lines into chunks of at most `max_len` characters, each line ending in a newline."""
+    chunks = []
+    current = []
+    size = 0
+    for line in lines:
+        if size + len(line) + 1 > max_len and current:
+            chunks.append('\n'.join(current) + '\n')
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append('\n'.join(current) + '\n')
+    return chunks
+
+
+def normalize_accounts(values) -> np.ndarray:
+    """Lower case account names, leaving missing values as NaN."""
+    return pd.Series(values, dtype=object).str.lower().to_numpy(dtype=object)
+
+
+def rows_named(names: pd.Series, accounts) -> np.ndarray:
+    """Positions in `names` whose lower cased name is in `accounts`, lowering each distinct name once for categories."""
+    accounts = list(accounts)
+    if isinstance(names.dtype, pd.CategoricalDtype):
+        hit = names.cat.categories.str.lower().isin(accounts)
+        codes = names.cat.codes.to_numpy()
+        return np.flatnonzero((codes >= 0) & hit[codes])
+    return np.flatnonzero(names.str.lower().isin(accounts).to_numpy())
+
+
+class LeaderboardIndex:
+    """
+    Lookup sheet and Discord members resolved once, ready to rank scraped balances.
+
+    Params:
+    lookup: lookup dataframe with references for account number and discord username
+    discord_names: dataframe from discord bot with user data for given channel, may be None
+    lookup_format: How to process the lookup data. 1=Basic, 2=Unpacked df from gary
+
+    Account names are normalized and every lookup row's member mention is resolved
+    up front, so ranking a results frame is a hash lookup per account and a sort.
+    Neither the lookup nor the results frame is modified. The last balances, PnL per
+    lookup row and ranking are kept, so given a ChangeSet only the changed accounts'
+    balances are read, only the rows referencing them are recomputed and only those
+    rows are moved in the ranking.
+    """
+
+    def __init__(self, lookup: pd.DataFrame, discord_names: pd.DataFrame = None, lookup_format: int = 1) -> None:
+        self.lookup_format = lookup_format
+        # State from the last call to pnl()/rank(), patched when called with a ChangeSet
+        self._balances = None
+        self._balance_values = None
+        self._new_balances = {}
+        self._pnl = None
+        self._changed_rows = None
+        self._order = None
+        # Primary then express account of every lookup row, built on the first incremental call
+        self._lookup_names = None
+
+        if lookup_format == 1:
+            accounts = lookup[lookup.columns[0]]
+            express = lookup[lookup.columns[2]] if lookup.shape[1] > 2 else None
+        elif lookup_format == 2:
+            accounts = lookup['Accounts']
+            express = lookup['ExpressAccountName'] if 'ExpressAccountName' in lookup.columns else None
+        else:
+            raise ValueError(f"Unknown lookup format: {lookup_format}")
+
+        self.accounts = normalize_accounts(accounts)
+        if express is None:
+            self.express = np.full(len(lookup), '', dtype=object)
+        else:
+            self.express = normalize_accounts(express)
+
+        if lookup_format == 1:
+            self.usernames = lookup[lookup.columns[1]].reset_index(drop=True)
+            self.resolve_members(discord_names)
+        else:
+            self.members = lookup['User ID'].map(lambda x: f"<@{x}>" if x != '0' else None).to_numpy(dtype=object)
+
+    def resolve_members(self, discord_names: pd.DataFrame) -> None:
+        """Mention members found in Discord, else show the sheet's username or the account's last 4 characters."""
+        if self.lookup_format != 1:
+            return
+
+        if discord_names is None or discord_names.empty or 'name' not in discord_names.columns:
+            ids = {}
+        else:
+            known = pd.DataFrame({
+                'name_lower': discord_names['name'].str.lower(),
+                'id': discord_names['id'].astype(str)
+            }).drop_duplicates('name_lower')
+            ids = dict(zip(known['name_lower'], known['id']))
+
+        # Strip whitespace and #xxx references before matching
+        username_keys = self.usernames.str.lower().str.strip().str.replace(r'#\d+$', '', regex=True)
+
+        mentions = username_keys.map(ids).map(lambda x: f"<@{x}>", na_action='ignore')
+        members = mentions.where(mentions.notna(), self.usernames)
+        fallback = pd.Series(self.accounts, dtype=object).str[-4:]
+        self.members = members.where(members.notna(), fallback).to_numpy(dtype=object)
+
+    @staticmethod
+    def _balances_from(results: pd.DataFrame) -> pd.Series:
+        """Balance per lower cased account name, including the dummy starting account."""
+        balances = pd.Series(parse_balance(results['Balance'], cents=True), index=normalize_accounts(results['AccountName']))
+        balances = balances[~balances.index.duplicated()]
+        if DUMMY_ACCOUNT not in balances.index:
+            balances[DUMMY_ACCOUNT] = START_BALANCE
+        return balances
+
+    def _affected_rows(self, accounts) -> np.ndarray:
+        """Lookup rows whose primary or express account is in `accounts`."""
+        if self._lookup_names is None:
+            self._lookup_names = pd.Index(np.concatenate([self.accounts, self.express]), dtype=object)
+
+        found = self._lookup_names.get_indexer_non_unique(list(accounts))[0]
+        return np.unique(found[found >= 0] % len(self.accounts))
+
+    def _update_balances(self, results: pd.DataFrame, changes) -> None:
+        """Patch the kept balances with the changed accounts' rows, NaN for accounts that are gone."""
+        rows = rows_named(results['AccountName'], changes.accounts)
+        names = normalize_accounts(results['AccountName'].iloc[rows])
+        # Reversed so the first row wins for duplicated names, the same as _balances_from()
+        updated = dict(zip(names[::-1], parse_balance(results['Balance'].iloc[rows], cents=True)[::-1]))
+
+        accounts = list(changes.accounts)
+        for account, position in zip(accounts, self._balances.index.get_indexer(accounts)):
+            if position >= 0:
+                self._balance_values[position] = updated.get(account, np.nan)
+            elif account in updated:
+                self._new_balances[account] = updated[account]
+            else:
+                self._new_balances.pop(account, None)
+
+        if DUMMY_ACCOUNT in changes.accounts and DUMMY_ACCOUNT not in updated:
+            self._balance_values[self._balances.index.get_loc(DUMMY_ACCOUNT)] = START_BALANCE
+
+    def _balance_of(self, accounts: np.ndarray) -> np.ndarray:
+        """Kept balance of each account, NaN where it wasn't scraped."""
+        positions = self._balances.index.get_indexer(accounts)
+        balance = np.where(positions >= 0, self._balance_values[positions], np.nan)
+        for i in np.flatnonzero(positions < 0):
+            balance[i] = self._new_balances.get(accounts[i], np.nan)
+        return balance
+
+    def pnl(self, results: pd.DataFrame, changes=None) -> np.ndarray:
+        """
+        PnL for every lookup row, NaN where the row's account wasn't scraped.
+
+        With a ChangeSet and a previous call to build on, only the changed accounts are read
+        from `results` and only the rows referencing them are recomputed, in place.
+        """
+        if changes is not None and self._pnl is not None:
+            self._update_balances(results, changes)
+            rows = self._affected_rows(changes.accounts)
+            balance = self._balance_of(self.accounts[rows])
+            express_balance = np.nan_to_num(self._balance_of(self.express[rows]), nan=0.0)
+
+            self._pnl[rows] = balance + express_balance - START_BALANCE
+            self._changed_rows = rows
+            return self._pnl
+
+        balances = self._balances = self._balances_from(results)
+        values = self._balance_values = balances.to_numpy(dtype=float, copy=True)
+        # Accounts first seen by an incremental call
+        self._new_balances = {}
+
+        primary = balances.index.get_indexer(self.accounts)
+        balance = np.where(primary >= 0, values[primary], np.nan)
+
+        # Add the balance from ExpressAccountName
+        express = balances.index.get_indexer(self.express)
+        express_balance = np.where(express >= 0, values[express], 0.0)
+        express_balance = np.nan_to_num(express_balance, nan=0.0)
+
+        self._pnl = balance + express_balance - START_BALANCE
+        self._changed_rows = None
+        self._order = None
+        return self._pnl
+
+    def _sort(self, rows: np.ndarray) -> np.ndarray:
+        """Rows by PnL descending, ties in lookup order."""
+        return rows[np.argsort(-self._pnl[rows], kind='stable')]
+
+    def _patch_order(self, rows: np.ndarray) -> np.ndarray:
+        """Move the recomputed `rows` to their new places in the kept ranking."""
+        pnl = self._pnl
+        order = self._order[~np.isin(self._order, rows)]
+        rows = rows[~np.isnan(pnl[rows])]
+        rows = rows[np.lexsort((rows, -pnl[rows]))]
+
+        keys = -pnl[order]
+        positions = np.searchsorted(keys, -pnl[rows], 'left')
+        ties_end = np.searchsorted(keys, -pnl[rows], 'right')
+        # Within equal PnLs the ranking stays in lookup order
+        for i in np.flatnonzero(ties_end > positions):
+            positions[i] += np.searchsorted(order[positions[i]:ties_end[i]], rows[i])
+
+        return np.insert(order, positions, rows)
+
+    def rank(self, results: pd.DataFrame, changes=None, top_n: int = None) -> pd.DataFrame:
+        """
+        Return the ranked leaderboard indexed from 1, with the lookup Row, its Account, PnL and Member.
+
+        With `top_n`, only the best `top_n` rows are selected and sorted, ties kept in lookup order.
+        With a ChangeSet, the last full ranking is patched instead of sorting again.
+        """
+        pnl = self.pnl(results, changes)
+
+        if self._changed_rows is not None:
+            if self._order is None:
+                self._order = self._sort(np.flatnonzero(~np.isnan(pnl)))
+            else:
+                self._order = self._patch_order(self._changed_rows)
+            order = self._order[:top_n]
+        else:
+            rows = np.flatnonzero(~np.isnan(pnl))
+            if top_n is not None and top_n < len(rows):
+                # Partial selection: everything at least as good as the top_n-th PnL, then sort just those
+                threshold = -np.partition(-pnl[rows], top_n - 1)[top_n - 1]
+                order = self._sort(rows[pnl[rows] >= threshold])[:top_n]
+            else:
+                order = self._order = self._sort(rows)
+
+        return pd.DataFrame({
+            'Row': order,
+            'Account': self.accounts[order],
+            'PnL': pnl[order],
+            'Member': self.members[order]
+        }, index=np.arange(1, len(order) + 1))
+
+    def format_lines(self, board: pd.DataFrame) -> list:
+        """
+        Render a ranked board as text lines, laid out the same as DataFrame.to_string().
+
+        The first three places are labelled with medal emojis, and members are looked up
+        again since they may have been resolved after the board was ranked.
+        """
+        labels = np.array([MEDALS.get(place, str(place)) for place in board.index], dtype=object)
+        pnl = np.char.add(' ', format_money(board['PnL'].to_numpy()).astype(str))
+        members = pd.Series(self.members[board['Row'].to_numpy()], dtype=object)
+        members = np.char.add(' ', members.map(str).where(members.notna(), 'NaN').to_numpy().astype(str))
+
+        label_width = max(len(label) for label in labels)
+        pnl_width = max(len('**PnL**'), np.char.str_len(pnl).max())
+        member_width = max(len('**Member**'), np.char.str_len(members).max())
+
+        header = ' ' * label_width + ' ' + '**PnL**'.rjust(pnl_width) + ' ' + '**Member**'.rjust(member_width)
+        lines = np.char.add(np.char.add(np.char.ljust(labels.astype(str), label_width), ' '), np.char.rjust(pnl, pnl_width))
+        lines = np.char.add(np.char.add(lines, ' '), np.char.rjust(members, member_width))
+        return [header] + lines.tolist()
+
+    def format(self, board: pd.DataFrame):
+        """Return a ranked board as a string for posting to discord, or False if it is empty."""
+        if board.empty:
+            return False
+
+        return '\n'.join(self.format_lines(board))
+
+    def format_chunks(self, board: pd.DataFrame, header: str, max_len: int = 2000) -> list:
+        """
+        Render a ranked board as messages of at most `max_len` characters, starting with `header`.
+
+        Medal rows are padded so their numbers line up with the others in Discord,
+        where each emoji is narrower than its :name:. Returns [] for an empty board.
+        """
+        if board.empty:
+            return []
+
+        lines = self.format_lines(board)
+        for position in range(1, min(4, len(lines))):
+            lines[position] = lines[position].replace(': ', ':         ', 1)
+        if len(lines) > 2:
+            lines[2] = lines[2].replace('second_place:', 'second_place: ', 1)
+
+        return split_lines([header] + lines, max_len)
+
+    def render(self, results: pd.DataFrame, changes=None, top_n: int = None):
+        """Return the leaderboard as a string for posting to discord, or False if it is empty."""
+        return self.format(self.rank(results, changes, top_n))
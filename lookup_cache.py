@@ -0,0 +1,120 @@
+import ast
+import hashlib
+import io
+import json
+import os
+import urllib.error
+import urllib.request
+import pandas as pd
+
+
+def parse_lookup(body: bytes, sheet_type: int) -> pd.DataFrame:
+    """
+    Parse the lookup sheet CSV.
+
+    Type 1 is headerless [accountname, username(, expressaccountname)].
+    Type 2 has an `Accounts` column holding a list literal, exploded to one row per account.
+    """
+    if sheet_type == 2:
+        data = pd.read_csv(io.BytesIO(body))
+        data['Accounts'] = data['Accounts'].apply(ast.literal_eval)
+        return data.explode('Accounts').reset_index().drop(columns=['index'])
+
+    return pd.read_csv(io.BytesIO(body), header=None)
+
+
+class LookupCache:
+    """
+    Local cache of the parsed lookup sheet.
+
+    The sheet is fetched with If-None-Match/If-Modified-Since, so an unchanged sheet
+    costs one 304 and no parse. The parsed (and for type 2, exploded) lookup is kept
+    as parquet next to a small JSON file with the validators. If the server sends no
+    validators, an unchanged body is still detected by its SHA-256 and not re-parsed.
+    Local file paths are validated by modification time instead.
+    """
+
+    def __init__(self, cache_dir: str, timeout: float = 30) -> None:
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+
+    def _paths(self, source: str, sheet_type: int):
+        key = hashlib.sha1(f"{sheet_type}:{source}".encode()).hexdigest()[:12]
+        return (os.path.join(self.cache_dir, f"lookup-{key}.json"),
+                os.path.join(self.cache_dir, f"lookup-{key}.parquet"))
+
+    def _load_meta(self, meta_path: str, data_path: str) -> dict:
+        if not (os.path.exists(meta_path) and os.path.exists(data_path)):
+            return {}
+        try:
+            with open(meta_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _read_cached(self, data_path: str, sheet_type: int) -> pd.DataFrame:
+        lookup = pd.read_parquet(data_path)
+        if sheet_type == 1:
+            # Parquet needs string column names, type 1 sheets are positional.
+            lookup.columns = range(lookup.shape[1])
+        return lookup
+
+    def _write_meta(self, meta_path: str, meta: dict) -> None:
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+    def _write_cache(self, meta_path: str, data_path: str, meta: dict, lookup: pd.DataFrame) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            lookup.rename(columns=str).to_parquet(data_path, index=False)
+        except (ImportError, ValueError, TypeError) as e:
+            print(f"INFO: Not caching lookup sheet: {e}")
+            return
+
+        self._write_meta(meta_path, meta)
+
+    def _fetch(self, source: str, meta: dict):
+        """Return (body, validators), with body None if the cached copy is still current."""
+        if not source.startswith(('http://', 'https://')):
+            modified = str(os.path.getmtime(source))
+            if meta.get('last_modified') == modified:
+                return None, meta
+            with open(source, 'rb') as f:
+                return f.read(), {'etag': None, 'last_modified': modified}
+
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            with urllib.request.urlopen(urllib.request.Request(source, headers=headers), timeout=self.timeout) as response:
+                return response.read(), {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified')
+                }
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and meta:
+                return None, meta
+            raise
+
+    def get(self, source: str, sheet_type: int) -> pd.DataFrame:
+        """Return the parsed lookup for `source`, downloading and parsing only if it changed."""
+        meta_path, data_path = self._paths(source, sheet_type)
+        meta = self._load_meta(meta_path, data_path)
+
+        body, validators = self._fetch(source, meta)
+        if body is None:
+            print('Lookup sheet unchanged, using cached copy.')
+            return self._read_cached(data_path, sheet_type)
+
+        digest = hashlib.sha256(body).hexdigest()
+        if meta and meta.get('sha256') == digest:
+            print('Lookup sheet content unchanged, using cached copy.')
+            self._write_meta(meta_path, {**validators, 'sha256': digest})
+            return self._read_cached(data_path, sheet_type)
+
+        lookup = parse_lookup(body, sheet_type)
+        self._write_cache(meta_path, data_path, {**validators, 'sha256': digest}, lookup)
+        return lookup
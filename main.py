@@ -1,114 +1,496 @@
+"""
+Scrape the TopStep report and post the challenge leaderboard to Discord.
+
+    python main.py [post]       scrape, and post the leaderboard if anything changed (default)
+    python main.py scrape       scrape and print the results
+    python main.py check        scrape and report whether anything changed, exit status 1 if not
+    python main.py daemon       keep the browser and bot running and post on every change
+
+Every command posts the leaderboards listed in JOBS_FILE, one per channel and lookup
+sheet, or a single leaderboard for DISCORD_CHANNEL and GOOGLE_SHEET without it. The
+report is scraped once and every message goes through the one bot connection.
+
+Heavy modules are imported inside the commands that use them. `check` never
+loads discord.py or the leaderboard code, and `post` imports discord.py in the
+background while the report is scraped.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib
+import json
 import os
-from tbm_stats import tbm_stats
-import pandas as pd
-import utils
-from tbm_stats import tbm_stats
-from discord_bot import DiscordBot
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
-import numpy as np
+import sys
 import time
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+from dotenv import load_dotenv
+from metrics import metrics
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from tbm_stats import tbm_stats
+    from discord_bot import DiscordBot
+    from leaderboard_index import LeaderboardIndex
+    from change_tracker import ChangeSet, RowHashStore
 
 load_dotenv(override=True)
 DEBUG = (os.getenv('DEBUG') == 'True')
+EDIT_IN_PLACE = (os.getenv('DISCORD_EDIT_IN_PLACE') == 'True')
+SEND_TIMEOUT = float(os.getenv('DISCORD_SEND_TIMEOUT', 120))
+# Only rank and post the best N accounts (0 = everyone)
+TOP_N = int(os.getenv('LEADERBOARD_TOP_N', 0)) or None
+# Worker processes for building several leaderboards at once (0 = one per CPU)
+JOBS_POOL_SIZE = int(os.getenv('JOBS_POOL_SIZE', 0)) or None
 
 if DEBUG:
     os.environ["GOOGLE_SHEET"] = os.getenv('DEBUG_GOOGLE_SHEET')
 
-tbm = tbm_stats()
 
-if DEBUG:
-    #results = pd.read_json(os.getenv('DEBUG_TS_DATA')) # use cached stats
-    #results = tbm.get_results()
-
-    # create spoof dataframe
-    src = pd.read_csv(os.getenv('GOOGLE_SHEET'), header=None)
-    # Generate random timestamps
-    start_date = datetime(2023, 8, 1)
-    end_date = datetime(2023, 9, 30)
-    date_range = [start_date + timedelta(seconds=np.random.randint(0, int((end_date-start_date).total_seconds()))) for _ in range(len(src))]
-    # Generate random balances
-    balances = ["${:,.2f}".format(np.random.uniform(47000, 50000)) for _ in range(len(src))]
-    results = pd.DataFrame({
-        "CreatedAt": date_range,
-        "AccountId": 123123,
-        "AccountName": src[src.columns[0]],
-        "Balance": balances
-    })
-
-
-else:
-    results = tbm.get_results()
-
-# Normalize the dataframe for hash generation/comparison
-results = results.sort_values('AccountId').reset_index(drop=True)
-print('=============Results DF=============')
-print(results)
-
-if (not utils.dataframe_has_changed(results, os.getenv('HASH_FILE')) and not DEBUG):
-    print('Data is the same. Exiting early.')
-    exit()
-
-# Save hash of the new dateframe
-print('Saving Dataframe Hash: ', utils.get_dataframe_hash(results))
-utils.save_dataframe_hash(results, os.getenv('HASH_FILE'))
-
-if os.getenv('SHEET_TYPE') == "2":
-    data = pd.read_csv(os.getenv('GOOGLE_SHEET'))
-    data['Accounts'] = data['Accounts'].apply(eval)
-    lookup = data.explode('Accounts').reset_index().drop(columns=['index'])
-    lookup_type = 2
-else:
-    lookup = pd.read_csv(os.getenv('GOOGLE_SHEET'), header=None)
-    lookup_type = 1
-
-print('Starting Discord Bot..')
-discord = DiscordBot()
-discord.run_bot()
-
-print('Waiting for Discord Bot to be ready..')
-while(not discord.is_ready()):
-    time.sleep(1)
-
-members = discord.get_channel_members()
-
-data = [{
-    'id': member.id,
-    'name': member.name,
-    'global_name': getattr(member, 'global_name', None),  # Using getattr in case some attributes might be missing
-    'nick': member.nick,
-    'guild_id': member.guild.id,
-    'guild_name': member.guild.name,
-} for member in members]
-
-# Convert the list of dictionaries into a DataFrame
-members_df = pd.DataFrame(data)
-
-leaderboard = utils.generate_leaderboard(results, lookup, members_df, lookup_format=lookup_type)
-
-if leaderboard == False:
-    discord.stop_bot()
-    print('Something went wrong, leaderboard is empty.')
-    exit()
-
-header_string = f":trophy: ***{datetime.now().strftime('%B')} Challenge*** :trophy:\n"
-
-message = header_string + leaderboard.replace(': ', ':         ', 3).replace('second_place:', 'second_place: ', 1)
-
-print(message)
-
-# debug
-if (DEBUG):
-    print(members_df)
-    print(leaderboard)
-    print(message)
-    discord.stop_bot()
-    exit()
-# /debug
-
-print('Sending Message to Discord..')
-discord.send_message(message)
-
-time.sleep(25) # wait for message to send before killing.
-
-discord.stop_bot()
\ No newline at end of file
+def get_results(tbm: tbm_stats) -> pd.DataFrame:
+    if DEBUG:
+        import numpy as np
+        from lookup_cache import LookupCache
+        from results_schema import to_results_frame
+
+        #results = pd.read_json(os.getenv('DEBUG_TS_DATA')) # use cached stats
+        #results = tbm.get_results()
+
+        # create spoof dataframe
+        src = LookupCache(os.getenv('LOOKUP_CACHE_DIR', '.cache')).get(os.getenv('GOOGLE_SHEET'), 1)
+        # Generate random timestamps
+        start_date = datetime(2023, 8, 1)
+        end_date = datetime(2023, 9, 30)
+        date_range = [start_date + timedelta(seconds=np.random.randint(0, int((end_date-start_date).total_seconds()))) for _ in range(len(src))]
+        # Generate random balances
+        balances = ["${:,.2f}".format(np.random.uniform(47000, 50000)) for _ in range(len(src))]
+        return to_results_frame({
+            "CreatedAt": date_range,
+            "AccountId": 123123,
+            "AccountName": src[src.columns[0]],
+            "Balance": balances
+        })
+
+    return tbm.get_results()
+
+
+async def get_results_async(tbm: tbm_stats) -> pd.DataFrame:
+    if DEBUG:
+        return await asyncio.get_event_loop().run_in_executor(None, get_results, tbm)
+
+    return await tbm.fetch_results()
+
+
+def normalize_results(results: pd.DataFrame) -> pd.DataFrame:
+    # Normalize the dataframe for hash generation/comparison
+    return results.sort_values('AccountId').reset_index(drop=True)
+
+
+def open_row_store() -> RowHashStore:
+    from change_tracker import RowHashStore
+
+    return RowHashStore(os.getenv('ROW_HASH_DB', 'rows.sqlite'))
+
+
+def load_jobs() -> list:
+    """
+    The leaderboards to post for every scrape.
+
+    JOBS_FILE is a JSON list of jobs like {"name": "community", "channel": 123,
+    "sheet": "https://docs.google.com/...", "sheet_type": 1, "top_n": 25}, where
+    sheet_type defaults to 1 and top_n to LEADERBOARD_TOP_N. Without it there is
+    one job for DISCORD_CHANNEL, GOOGLE_SHEET and SHEET_TYPE.
+    """
+    if not os.getenv('JOBS_FILE'):
+        return [{
+            'name': 'default',
+            'channel': int(os.getenv('DISCORD_CHANNEL')),
+            'sheet': os.getenv('GOOGLE_SHEET'),
+            'sheet_type': 2 if os.getenv('SHEET_TYPE') == "2" else 1,
+            'top_n': TOP_N
+        }]
+
+    with open(os.getenv('JOBS_FILE'), 'r') as f:
+        jobs = json.load(f)
+
+    for job in jobs:
+        job['channel'] = int(job['channel'])
+        job['sheet_type'] = int(job.get('sheet_type', 1))
+        job['top_n'] = int(job['top_n'] or 0) or None if 'top_n' in job else TOP_N
+        job.setdefault('name', str(job['channel']))
+    return jobs
+
+
+def ranking_key(job: dict) -> str:
+    # The single-channel setup keeps the ranking it saved before there were jobs
+    return 'ranking' if job['name'] == 'default' else f"ranking:{job['name']}"
+
+
+def get_lookup(job: dict):
+    from lookup_cache import LookupCache
+
+    cache = LookupCache(os.getenv('LOOKUP_CACHE_DIR', '.cache'))
+
+    with metrics.span('sheet_download'):
+        return cache.get(job['sheet'], job['sheet_type']), job['sheet_type']
+
+
+def start_discord() -> DiscordBot:
+    from discord_bot import DiscordBot
+
+    print('Starting Discord Bot..')
+    discord = DiscordBot()
+    discord.run_bot()
+
+    print('Waiting for Discord Bot to be ready..')
+    while(not discord.is_ready()):
+        time.sleep(1)
+
+    return discord
+
+
+async def connect_discord(bot: asyncio.Future):
+    """Import discord.py off the event loop, then log in and stay connected."""
+    module = await asyncio.get_event_loop().run_in_executor(None, importlib.import_module, 'discord_bot')
+    discord = module.DiscordBot()
+    bot.set_result(discord)
+    await discord.start(os.getenv('DISCORD_TOKEN'))
+
+
+async def wait_discord_ready(bot: asyncio.Future):
+    with metrics.span('discord_login'):
+        discord = await bot
+        await discord.ready_event.wait()
+
+
+def get_members_df(discord: DiscordBot, lookup: pd.DataFrame, lookup_format: int, channel_id: int = None) -> pd.DataFrame:
+    """Members referenced by the lookup sheet, resolved through the bot's member directory."""
+    import pandas as pd
+
+    if lookup_format != 1:
+        # Gary's sheet already holds Discord ids
+        return pd.DataFrame()
+
+    return discord.resolve_members(lookup[lookup.columns[1]].dropna(), channel_id)
+
+
+async def get_members_df_async(discord: DiscordBot, lookup: pd.DataFrame, lookup_format: int, channel_id: int = None) -> pd.DataFrame:
+    """get_members_df for a bot running on the current event loop."""
+    import pandas as pd
+
+    if lookup_format != 1:
+        return pd.DataFrame()
+
+    return await discord.resolve_members_async(lookup[lookup.columns[1]].dropna(), channel_id)
+
+
+def message_header() -> str:
+    return f":trophy: ***{datetime.now().strftime('%B')} Challenge*** :trophy:"
+
+
+def build_message(index: LeaderboardIndex, board: pd.DataFrame) -> list:
+    """The leaderboard as Discord-sized messages, [] if the board is empty."""
+    return index.format_chunks(board, message_header())
+
+
+def save_snapshot(results: pd.DataFrame):
+    """Keep accepted results in the history store when SNAPSHOT_DIR is configured."""
+    if os.getenv('SNAPSHOT_DIR'):
+        from snapshot_store import SnapshotStore
+
+        SnapshotStore(os.getenv('SNAPSHOT_DIR')).append(results)
+
+
+def should_post(job: dict, ranking: list, store: RowHashStore) -> bool:
+    """Whether a job's new ranking is worth posting under POST_THRESHOLD."""
+    if os.getenv('POST_THRESHOLD', 'any') == 'rank' and not store.rank_changed(ranking, ranking_key(job)):
+        print(f"{job['name']}: No rank changed.")
+        return False
+
+    return True
+
+
+def rank_results(job: dict, index: LeaderboardIndex, results: pd.DataFrame, changes: ChangeSet, store: RowHashStore):
+    """Rank the changed results for one job and decide whether they are worth posting."""
+    with metrics.span('rank'):
+        board = index.rank(results, changes, top_n=job['top_n'])
+
+    return board, should_post(job, list(board['Account']), store)
+
+
+async def build_leaderboards(jobs: list, results: pd.DataFrame, lookups: list, members: list) -> list:
+    """
+    (ranking, message) for every job, built in parallel worker processes.
+
+    Each job ranks the whole results frame against its own lookup sheet, so with more
+    than one job they are spread over a pool of JOBS_POOL_SIZE processes. A single job
+    runs on a thread, which saves starting a process.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from utils import generate_leaderboard_chunks
+
+    loop = asyncio.get_event_loop()
+    header = message_header()
+    pool = ProcessPoolExecutor(min(len(jobs), JOBS_POOL_SIZE or os.cpu_count())) if len(jobs) > 1 else None
+
+    try:
+        with metrics.span('leaderboards'):
+            return await asyncio.gather(*(
+                loop.run_in_executor(pool, generate_leaderboard_chunks, results, lookup, members_df, lookup_type, header, job['top_n'])
+                for job, (lookup, lookup_type), members_df in zip(jobs, lookups, members)
+            ))
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+async def run_pipeline():
+    """
+    Scrape, fetch the lookup sheets and log in to Discord concurrently on one loop.
+
+    The leaderboards are built once all three are ready, and the other tasks are
+    cancelled as soon as the scrape shows nothing changed. discord.py itself is
+    only imported by the login task, so it never holds up the scrape.
+    """
+    from tbm_stats import tbm_stats
+
+    loop = asyncio.get_event_loop()
+    jobs = load_jobs()
+    tbm = tbm_stats()
+    bot = loop.create_future()
+
+    print(f"Starting scrape, {len(jobs)} lookup fetch(es) and Discord login..")
+    scrape = asyncio.ensure_future(get_results_async(tbm))
+    lookup_task = asyncio.gather(*(loop.run_in_executor(None, get_lookup, job) for job in jobs))
+    login = asyncio.ensure_future(connect_discord(bot))
+    ready = asyncio.ensure_future(wait_discord_ready(bot))
+
+    try:
+        with metrics.span('scrape'):
+            results = normalize_results(await scrape)
+        print('=============Results DF=============')
+        print(results)
+
+        store = open_row_store()
+        changes = store.diff(results)
+        print(f"Changes since last run: {changes}")
+
+        if (not changes and not DEBUG):
+            print('Data is the same. Exiting early.')
+            return
+
+        lookups = await lookup_task
+
+        print('Waiting for Discord Bot to be ready..')
+        await asyncio.wait([ready, login], return_when=asyncio.FIRST_COMPLETED)
+        if login.done():
+            # start() only returns early if logging in or connecting failed
+            login.result()
+            raise Exception('Discord Bot stopped before it was ready')
+
+        from discord_bot import DeliveryError
+
+        discord = bot.result()
+        with metrics.span('member_resolve'):
+            members = [
+                await get_members_df_async(discord, lookup, lookup_type, job['channel'])
+                for job, (lookup, lookup_type) in zip(jobs, lookups)
+            ]
+
+        boards = await build_leaderboards(jobs, results, lookups, members)
+
+        # Save row hashes of the new dataframe
+        store.commit(results)
+        save_snapshot(results)
+
+        for job, (ranking, message) in zip(jobs, boards):
+            if not message:
+                print(f"{job['name']}: Something went wrong, leaderboard is empty.")
+                continue
+
+            if (not should_post(job, ranking, store) and not DEBUG):
+                continue
+
+            print(''.join(message))
+
+            # debug
+            if (DEBUG):
+                print(f"{job['name']}: {len(message)} message(s): {[len(chunk) for chunk in message]} characters")
+                continue
+            # /debug
+
+            print(f"Sending {job['name']} leaderboard to Discord..")
+            try:
+                await asyncio.wait_for(discord.send_message_async(message, edit=EDIT_IN_PLACE, channel_id=job['channel']), SEND_TIMEOUT)
+            except DeliveryError as e:
+                print(f"Message was not fully delivered: {e}")
+                continue
+            metrics.count('leaderboards_posted')
+
+            # Only remember the ranking once it has been posted.
+            store.save_ranking(ranking, ranking_key(job))
+    finally:
+        for task in (scrape, lookup_task, ready):
+            task.cancel()
+        if bot.done() and not bot.cancelled():
+            await bot.result().close()
+        login.cancel()
+        await asyncio.gather(login, return_exceptions=True)
+
+
+def run_once():
+    asyncio.get_event_loop().run_until_complete(run_pipeline())
+
+
+def run_scrape(output: str = None):
+    """Scrape and print the results, or every report in TARGET_URLS, optionally saving them as CSV."""
+    if os.getenv('TARGET_URLS'):
+        from tbm_stats import get_reports
+
+        reports = get_reports()
+    else:
+        from tbm_stats import tbm_stats
+
+        reports = {None: get_results(tbm_stats())}
+
+    for name, results in reports.items():
+        results = normalize_results(results)
+        if name is not None:
+            print(f"=============Report {name}=============")
+        print(results)
+
+        if output:
+            # One file per report, e.g. results-march.csv
+            root, ext = os.path.splitext(output)
+            path = output if name is None else f"{root}-{name}{ext}"
+            results.to_csv(path, index=False)
+            print(f"Saved results to {path}")
+
+
+def run_check() -> int:
+    """Scrape and compare with the last committed results without committing. Returns the exit status."""
+    from tbm_stats import tbm_stats
+
+    results = normalize_results(get_results(tbm_stats()))
+    changes = open_row_store().diff(results)
+    print(f"Changes since last run: {changes}")
+
+    return 0 if changes else 1
+
+
+def run_daemon():
+    """Keep the browser and Discord bot running and post every job's leaderboard whenever the results change."""
+    from tbm_stats import tbm_stats
+    from discord_bot import DeliveryError
+    from leaderboard_index import LeaderboardIndex
+
+    interval = float(os.getenv('DAEMON_INTERVAL', 300))
+    jobs = load_jobs()
+    tbm = tbm_stats()
+    store = open_row_store()
+    discord = start_discord()
+    # Reused between captures while a job's lookup sheet is unchanged, so only changed rows are recomputed.
+    # That makes each job cheap enough that they run in this process rather than a pool.
+    state = {job['name']: {'lookup': None, 'index': None} for job in jobs}
+
+    def on_results(results: pd.DataFrame):
+        try:
+            post_results(results)
+        finally:
+            metrics.export()
+
+    def build_job(job: dict, results: pd.DataFrame, changes: ChangeSet):
+        lookup, lookup_type = get_lookup(job)
+        job_state = state[job['name']]
+        if job_state['lookup'] is None or not lookup.equals(job_state['lookup']):
+            job_state['lookup'] = lookup
+            job_state['index'] = LeaderboardIndex(lookup, None, lookup_format=lookup_type)
+            changes = None
+
+        index = job_state['index']
+        board, post = rank_results(job, index, results, changes, store)
+        return index, board, post
+
+    def post_results(results: pd.DataFrame):
+        results = normalize_results(results)
+
+        changes = store.diff(results)
+        if not changes:
+            print(f"{datetime.now():%H:%M:%S} Data is the same.")
+            return
+        print(f"{datetime.now():%H:%M:%S} Changes: {changes}")
+
+        try:
+            boards = [(job, *build_job(job, results, changes)) for job in jobs]
+            store.commit(results)
+            save_snapshot(results)
+        except Exception as e:
+            print(f"Failed to build leaderboard: {e}")
+            return
+
+        for job, index, board, post in boards:
+            if not post:
+                continue
+
+            try:
+                with metrics.span('member_resolve'):
+                    index.resolve_members(get_members_df(discord, state[job['name']]['lookup'], index.lookup_format, job['channel']))
+                with metrics.span('format'):
+                    message = build_message(index, board)
+            except Exception as e:
+                print(f"Failed to build {job['name']} leaderboard: {e}")
+                continue
+
+            if not message:
+                print(f"{job['name']}: Something went wrong, leaderboard is empty.")
+                continue
+
+            print(f"Sending {job['name']} leaderboard to Discord..")
+            try:
+                discord.send_message(message, edit=EDIT_IN_PLACE, channel_id=job['channel'], timeout=SEND_TIMEOUT)
+            except DeliveryError as e:
+                print(f"Message was not fully delivered: {e}")
+                continue
+            metrics.count('leaderboards_posted')
+
+            # Only remember the ranking once it has been posted.
+            store.save_ranking(list(board['Account']), ranking_key(job))
+
+    print(f"Watching report every {interval:g} seconds for {len(jobs)} leaderboard(s)..")
+    try:
+        asyncio.get_event_loop().run_until_complete(tbm.watch(interval, on_results))
+    finally:
+        asyncio.get_event_loop().run_until_complete(tbm.close_session())
+        discord.stop_bot()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Post the TopStep challenge leaderboard to Discord.')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('post', help='scrape and post the leaderboard if anything changed (default)')
+    scrape = commands.add_parser('scrape', help='scrape and print the results, of every report in TARGET_URLS if set')
+    scrape.add_argument('--output', help='also save the results to this CSV file')
+    commands.add_parser('check', help='scrape and report whether anything changed, exit status 1 if not')
+    commands.add_parser('daemon', help='keep running and post whenever the results change')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    try:
+        if args.command == 'scrape':
+            run_scrape(args.output)
+        elif args.command == 'check':
+            sys.exit(run_check())
+        elif args.command == 'daemon':
+            run_daemon()
+        else:
+            run_once()
+    finally:
+        metrics.export()
+
+
+if __name__ == '__main__':
+    main()
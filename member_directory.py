@@ -0,0 +1,123 @@
+import re
+import sqlite3
+import threading
+import time
+import pandas as pd
+
+
+def normalize_name(value) -> str:
+    """Lower case, strip whitespace and any #xxxx discriminator, matching how the lookup sheet is compared."""
+    if not isinstance(value, str):
+        return None
+    return re.sub(r'#\d+$', '', value.lower().strip())
+
+
+class MemberDirectory:
+    """
+    Persistent cache of guild members in SQLite, keyed by guild and member id.
+
+    `name`, `global_name` and `nick` are stored as-is together with normalized keys.
+    The bot keeps it current from member join/update/remove events, and callers ask
+    only for the usernames they need in one guild instead of downloading the whole
+    guild. Names that were searched for in a guild and not found are remembered for
+    `miss_ttl` seconds. Members are only trusted for `hit_ttl` seconds after they were
+    last seen, events are not delivered for members the bot hasn't cached, so `stale`
+    names are looked up again.
+    """
+
+    COLUMNS = ['id', 'name', 'global_name', 'nick', 'guild_id']
+
+    def __init__(self, filename: str, miss_ttl: float = 86400, hit_ttl: float = 604800) -> None:
+        self.miss_ttl = miss_ttl
+        self.hit_ttl = hit_ttl
+        self.lock = threading.Lock()
+        # Written from the bot thread and read from the main thread
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        with self.lock, self.conn:
+            # Caches from before members were kept per guild are dropped and refilled
+            if 'searched_at' in self._columns('misses') and 'guild_id' not in self._columns('misses'):
+                self.conn.execute('DROP TABLE members')
+                self.conn.execute('DROP TABLE misses')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS members (
+                guild_id INTEGER, id INTEGER, name TEXT, global_name TEXT, nick TEXT,
+                name_key TEXT, global_name_key TEXT, nick_key TEXT, seen_at REAL, PRIMARY KEY (guild_id, id))''')
+            # Members cached before seen_at was kept count as stale
+            if 'seen_at' not in self._columns('members'):
+                self.conn.execute('ALTER TABLE members ADD COLUMN seen_at REAL DEFAULT 0')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS members_name_key ON members (guild_id, name_key)')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS misses (
+                guild_id INTEGER, name_key TEXT, searched_at REAL, PRIMARY KEY (guild_id, name_key))''')
+
+    def _columns(self, table: str) -> list:
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+
+    def upsert(self, member) -> None:
+        """Add or update a discord.Member."""
+        global_name = getattr(member, 'global_name', None)  # Using getattr in case some attributes might be missing
+        nick = getattr(member, 'nick', None)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                member.guild.id, member.id, member.name, global_name, nick,
+                normalize_name(member.name), normalize_name(global_name), normalize_name(nick), time.time()
+            ))
+            self.conn.execute('DELETE FROM misses WHERE guild_id = ? AND name_key = ?', (member.guild.id, normalize_name(member.name)))
+
+    def update_user(self, user) -> None:
+        """Apply a discord.User's new name and global_name to the member in every guild."""
+        global_name = getattr(user, 'global_name', None)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'UPDATE members SET name = ?, global_name = ?, name_key = ?, global_name_key = ?, seen_at = ? WHERE id = ?',
+                (user.name, global_name, normalize_name(user.name), normalize_name(global_name), time.time(), user.id))
+
+    def remove(self, guild_id: int, member_id: int) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM members WHERE guild_id = ? AND id = ?', (guild_id, member_id))
+
+    def forget(self, name_key: str, guild_id: int) -> None:
+        """Drop the members of `guild_id` cached under `name_key`, before replacing them with a fresh lookup."""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM members WHERE guild_id = ? AND name_key = ?', (guild_id, name_key))
+
+    def record_misses(self, name_keys, guild_id: int) -> None:
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO misses VALUES (?, ?, ?)', [(guild_id, key, now) for key in name_keys])
+
+    def find(self, name_keys, guild_id: int) -> pd.DataFrame:
+        """Return the members of `guild_id` whose normalized name is in `name_keys`."""
+        name_keys = list(name_keys)
+        frames = []
+        with self.lock:
+            # Stay under SQLite's bound parameter limit
+            for start in range(0, len(name_keys), 500):
+                batch = name_keys[start:start + 500]
+                frames.append(pd.read_sql_query(
+                    f"SELECT {', '.join(self.COLUMNS)} FROM members WHERE guild_id = ? AND name_key IN ({', '.join('?' * len(batch))})",
+                    self.conn, params=[guild_id] + batch))
+        if not frames:
+            return pd.DataFrame(columns=self.COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    def unresolved(self, name_keys, guild_id: int) -> set:
+        """Names with no cached member in `guild_id` that haven't recently been searched for there without success."""
+        name_keys = set(key for key in name_keys if key)
+        found = set(self.find(name_keys, guild_id)['name'].map(normalize_name))
+        cutoff = time.time() - self.miss_ttl
+        with self.lock:
+            recent = set(row[0] for row in self.conn.execute(
+                'SELECT name_key FROM misses WHERE guild_id = ? AND searched_at >= ?', (guild_id, cutoff)))
+        return name_keys - found - recent
+
+    def stale(self, name_keys, guild_id: int, limit: int = None) -> list:
+        """Cached names in `guild_id` not seen for `hit_ttl` seconds, least recently seen first."""
+        name_keys = [key for key in set(name_keys) if key]
+        cutoff = time.time() - self.hit_ttl
+        rows = []
+        with self.lock:
+            for start in range(0, len(name_keys), 500):
+                batch = name_keys[start:start + 500]
+                rows += self.conn.execute(
+                    f"SELECT name_key, MAX(seen_at) FROM members WHERE guild_id = ? AND name_key IN ({', '.join('?' * len(batch))}) "
+                    "GROUP BY name_key HAVING MAX(seen_at) < ?", [guild_id] + batch + [cutoff]).fetchall()
+        return [key for key, _ in sorted(rows, key=lambda row: row[1])][:limit]
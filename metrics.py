@@ -0,0 +1,85 @@
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Stage timings and counters for one process, exported as a JSON run report and a Prometheus textfile.
+
+    `span(name)` times a block, sync or async, and every completed span adds to that
+    stage's count, total and max seconds. `count(name)` increments a counter.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.started_at = time.time()
+        self.spans = defaultdict(lambda: {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name: str, seconds: float) -> None:
+        stage = self.spans[name]
+        stage['count'] += 1
+        stage['total'] += seconds
+        stage['max'] = max(stage['max'], seconds)
+        stage['last'] = seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def report(self) -> dict:
+        return {
+            'started_at': self.started_at,
+            'duration': time.time() - self.started_at,
+            'spans': {name: dict(stage) for name, stage in self.spans.items()},
+            'counters': dict(self.counters)
+        }
+
+    def prometheus(self, prefix: str = 'tbm') -> str:
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent per pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds summary"
+        ]
+        for name, stage in sorted(self.spans.items()):
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["total"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        lines.append(f"# HELP {prefix}_stage_last_seconds Duration of the last span per stage.")
+        lines.append(f"# TYPE {prefix}_stage_last_seconds gauge")
+        for name, stage in sorted(self.spans.items()):
+            lines.append(f'{prefix}_stage_last_seconds{{stage="{name}"}} {stage["last"]:.6f}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        lines.append(f"# TYPE {prefix}_last_run_timestamp_seconds gauge")
+        lines.append(f"{prefix}_last_run_timestamp_seconds {self.started_at:.0f}")
+        return '\n'.join(lines) + '\n'
+
+    def _write(self, filename: str, content: str) -> None:
+        # Written to a temporary file and renamed, so the textfile collector never reads half a file
+        tmp = f"{filename}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(content)
+        os.replace(tmp, filename)
+
+    def export(self) -> None:
+        """Write the run report to METRICS_JSON and the Prometheus textfile to METRICS_PROM, where set."""
+        if os.getenv('METRICS_JSON'):
+            self._write(os.getenv('METRICS_JSON'), json.dumps(self.report(), indent=2))
+        if os.getenv('METRICS_PROM'):
+            self._write(os.getenv('METRICS_PROM'), self.prometheus())
+
+
+# Shared by every module in the process
+metrics = Metrics()
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+
+def missing_as_na(values) -> pd.Series:
+    """Treat the report's 'null' strings and empty cells as missing."""
+    values = pd.Series(values)
+    if not pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_datetime64_any_dtype(values):
+        values = values.mask(values.isin(['null', '']))
+    return values
+
+
+def parse_balance(balance: pd.Series, cents: bool = False) -> np.ndarray:
+    """
+    Convert a Balance column to float dollars, NaN where missing.
+
+    Values as extracted from the report, strings such as "$49,123.45" or numbers, are
+    dollars whatever their dtype. Pass `cents=True` for the Balance column of a typed
+    results frame.
+    """
+    if cents:
+        return balance.to_numpy(dtype=float, na_value=np.nan) / 100
+    if not pd.api.types.is_numeric_dtype(balance):
+        balance = missing_as_na(balance).astype(str).str.replace('[$,]', '', regex=True)
+    return pd.to_numeric(balance, errors='coerce').to_numpy(dtype=float)
+
+
+def balance_cents(balance: pd.Series, typed: bool = False) -> pd.Series:
+    """Balance as nullable int64 cents, from extracted dollars or, with `typed=True`, from cents."""
+    if typed:
+        return balance.astype('Int64')
+    balance = missing_as_na(balance)
+    return pd.Series(np.round(parse_balance(balance) * 100), index=balance.index).astype('Int64')
+
+
+def account_ids(values: pd.Series) -> pd.Series:
+    """AccountId as nullable int64, or left as a category if the report's ids aren't all numeric."""
+    values = missing_as_na(values)
+    numbers = pd.to_numeric(values, errors='coerce')
+    if numbers.notna().sum() < values.notna().sum() or (numbers.dropna() % 1 != 0).any():
+        return values.astype('category')
+    return numbers.astype('Int64')
+
+
+def created_at(values: pd.Series) -> pd.Series:
+    """CreatedAt as datetime64, from date strings or epoch milliseconds."""
+    values = missing_as_na(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_datetime(values, unit='ms', errors='coerce')
+    return pd.to_datetime(values, errors='coerce', format='mixed')
+
+
+def to_results_frame(data, typed: bool = False) -> pd.DataFrame:
+    """
+    Build the typed results frame from extracted columns ({column: values} or a frame).
+
+    CreatedAt becomes datetime64, AccountId nullable int64, AccountName a category and
+    Balance nullable int64 cents, extracted balances are always read as dollars. Pass
+    `typed=True` to pass an already typed frame, e.g. merged ones, through again with
+    Balance kept as cents. Other columns are kept as they are.
+    """
+    frame = pd.DataFrame(data)
+    converters = {
+        'CreatedAt': created_at,
+        'AccountId': account_ids,
+        'AccountName': lambda values: missing_as_na(values).astype('category'),
+        'Balance': lambda values: balance_cents(values, typed=typed)
+    }
+    for column, convert in converters.items():
+        if column in frame.columns:
+            frame[column] = convert(frame[column])
+    return frame
@@ -0,0 +1,162 @@
+import glob
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from results_schema import balance_cents
+
+
+def balance_to_cents(balance: pd.Series) -> np.ndarray:
+    """Convert a typed Balance column to int64 cents, NaN balances become -1 and should be dropped."""
+    return balance_cents(balance, typed=True).fillna(-1).to_numpy(dtype='int64')
+
+
+class SnapshotStore:
+    """
+    Append-only history of scraped results as parquet, partitioned by month.
+
+    Layout is `<root>/month=YYYY-MM/*.parquet` with columns taken_at, AccountId,
+    AccountName and Balance (int64 cents). Every snapshot is written as its own
+    small file and, once a month holds `compact_every` of them, they are merged into
+    one file sorted by time. File names carry the time of their first and last
+    snapshot, so queries only open the months and files they need and only read
+    the columns they use.
+    """
+
+    COLUMNS = ['taken_at', 'AccountId', 'AccountName', 'Balance']
+
+    def __init__(self, root: str, compact_every: int = 288) -> None:
+        self.root = root
+        self.compact_every = compact_every
+
+    def _partition(self, month: str) -> str:
+        return os.path.join(self.root, f"month={month}")
+
+    def append(self, results: pd.DataFrame, taken_at: datetime = None) -> str:
+        """Store one snapshot of `results` and return the file written."""
+        taken_at = pd.Timestamp(taken_at or datetime.now())
+        cents = balance_to_cents(results['Balance'])
+        keep = cents >= 0
+
+        snapshot = pd.DataFrame({
+            'taken_at': np.full(keep.sum(), taken_at.to_datetime64()),
+            'AccountId': results['AccountId'].astype(str).to_numpy()[keep],
+            'AccountName': results['AccountName'].astype(str).to_numpy()[keep],
+            'Balance': cents[keep]
+        })
+
+        partition = self._partition(taken_at.strftime('%Y-%m'))
+        os.makedirs(partition, exist_ok=True)
+        path = os.path.join(partition, f"snap-{taken_at:%Y%m%dT%H%M%S%f}.parquet")
+        snapshot.to_parquet(path, index=False)
+
+        if len(glob.glob(os.path.join(partition, 'snap-*.parquet'))) >= self.compact_every:
+            self.compact(partition)
+
+        return path
+
+    def compact(self, partition: str) -> None:
+        """Merge a month's individual snapshot files into one time-sorted file."""
+        files = sorted(glob.glob(os.path.join(partition, 'snap-*.parquet')))
+        if len(files) < 2:
+            return
+
+        merged = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True).sort_values('taken_at', kind='stable')
+        first = os.path.basename(files[0])[5:-8]
+        last = os.path.basename(files[-1])[5:-8]
+        merged.to_parquet(os.path.join(partition, f"part-{first}-{last}.parquet"), index=False)
+
+        for f in files:
+            os.remove(f)
+
+    @staticmethod
+    def _file_range(path: str) -> tuple:
+        """First and last taken_at in a file, from its name: snap-<time> or part-<first>-<last>."""
+        stamps = os.path.basename(path)[5:-8].split('-')
+        times = [pd.Timestamp(datetime.strptime(stamp, '%Y%m%dT%H%M%S%f')) for stamp in stamps]
+        return times[0], times[-1]
+
+    def _files(self) -> list:
+        """(first, last, path) for every snapshot file, oldest first."""
+        paths = glob.glob(os.path.join(self.root, 'month=*', '*.parquet'))
+        return sorted((*self._file_range(path), path) for path in paths)
+
+    def _snapshot(self, path: str, taken_at: pd.Timestamp, columns: list) -> pd.DataFrame:
+        """The rows of the single snapshot taken at `taken_at` in `path`."""
+        return pd.read_parquet(path, columns=columns, filters=[('taken_at', '==', taken_at)])
+
+    def read(self, columns: list, since: datetime = None) -> pd.DataFrame:
+        """Read `columns` from every snapshot taken at or after `since`."""
+        since = pd.Timestamp(since) if since is not None else None
+        partitions = sorted(glob.glob(os.path.join(self.root, 'month=*')))
+        if since is not None:
+            partitions = [p for p in partitions if os.path.basename(p)[6:] >= since.strftime('%Y-%m')]
+
+        columns = list(dict.fromkeys(['taken_at'] + columns))
+        filters = [('taken_at', '>=', since)] if since is not None else None
+
+        frames = [
+            pd.read_parquet(path, columns=columns, filters=filters)
+            for partition in partitions
+            for path in sorted(glob.glob(os.path.join(partition, '*.parquet')))
+        ]
+        if not frames:
+            return pd.DataFrame({column: [] for column in columns})
+
+        return pd.concat(frames, ignore_index=True).sort_values('taken_at', kind='stable')
+
+    def pnl_delta_since(self, since: datetime) -> pd.DataFrame:
+        """
+        Balance movement per account between the first snapshot at or after `since` and the latest one.
+
+        Returns AccountName, Start, End and Delta in cents, largest gain first.
+        """
+        since = pd.Timestamp(since)
+        files = [(first, last, path) for first, last, path in self._files() if last >= since]
+        columns = ['AccountName', 'Balance']
+        if not files:
+            return pd.DataFrame({'AccountName': [], 'Start': [], 'End': [], 'Delta': []})
+
+        first, _, path = files[0]
+        if first < since:
+            # A compacted file spanning `since`, find its first snapshot from the taken_at column alone
+            first = pd.read_parquet(path, columns=['taken_at'], filters=[('taken_at', '>=', since)])['taken_at'].min()
+        start = self._snapshot(path, first, columns)
+        _, latest, path = files[-1]
+        end = self._snapshot(path, latest, columns)
+
+        delta = pd.DataFrame({
+            'Start': start.drop_duplicates('AccountName').set_index('AccountName')['Balance'],
+            'End': end.drop_duplicates('AccountName').set_index('AccountName')['Balance']
+        }).dropna().astype('int64')
+        delta['Delta'] = delta['End'] - delta['Start']
+        return delta.sort_values('Delta', ascending=False).rename_axis('AccountName').reset_index()
+
+    def rank_history(self, account_name: str = None, since: datetime = None) -> pd.DataFrame:
+        """
+        Rank of each account by balance in every snapshot, optionally for a single account.
+
+        `since` defaults to the start of the latest month, the current challenge, so a
+        query never reads the whole history unless asked to.
+
+        Returns taken_at, AccountName and Rank (1 = highest balance).
+        """
+        if since is None:
+            files = self._files()
+            if files:
+                since = files[-1][1].to_period('M').start_time
+
+        history = self.read(['AccountName', 'Balance'], since)
+
+        if account_name is None:
+            history['Rank'] = history.groupby('taken_at')['Balance'].rank(ascending=False, method='min').astype('int64')
+            return history[['taken_at', 'AccountName', 'Rank']].reset_index(drop=True)
+
+        # One account's rank is one more than the number of higher balances in the same snapshot
+        account = history[history['AccountName'].str.lower() == account_name.lower()]
+        account = account.drop_duplicates('taken_at')[['taken_at', 'AccountName', 'Balance']]
+        compared = history[['taken_at', 'Balance']].merge(account[['taken_at', 'Balance']], on='taken_at', suffixes=('', '_account'))
+        higher = (compared['Balance'] > compared['Balance_account']).groupby(compared['taken_at']).sum()
+
+        account['Rank'] = account['taken_at'].map(higher).fillna(0).astype('int64') + 1
+        return account[['taken_at', 'AccountName', 'Rank']].reset_index(drop=True)
@@ -1,54 +1,267 @@
 import asyncio
+import base64
+import json
 from pyppeteer import launch, errors
 from pyppeteer.connection import Connection
 import pandas as pd
 from dotenv import load_dotenv
 import os
+import re
+import sys
+from breakpoint_cache import BreakpointCache
+from column_mapping import ColumnMapping, load_column_mapping
+from cdp_replay import CDPRecorder, ReplayBrowser
+from metrics import metrics
+from results_schema import to_results_frame
+
+# Runs against the paused frame's `this` and returns cellContent by value.
+# Mirrors the walker: each cell is reduced to its first own property, nested
+# objects become arrays of their property values and recursion stops at depth 5.
+SERIALIZE_CELL_CONTENT = """
+function (keys) {
+    const content = this.cellContent;
+    if (!content) {
+        return null;
+    }
+    const convert = (value, depth) => {
+        if (value === null || typeof value !== 'object') {
+            return value;
+        }
+        if (depth > 5) {
+            return {};
+        }
+        return Object.getOwnPropertyNames(value).map(name => convert(value[name], depth + 1));
+    };
+    const columns = {};
+    for (const key of (keys || Object.getOwnPropertyNames(content))) {
+        const column = content[key];
+        if (column === null || typeof column !== 'object') {
+            continue;
+        }
+        const values = [];
+        for (const name of Object.getOwnPropertyNames(column)) {
+            const cell = column[name];
+            if (cell === null || typeof cell !== 'object') {
+                continue;
+            }
+            const first = Object.getOwnPropertyNames(cell)[0];
+            values.push(first === undefined ? null : convert(cell[first], 2));
+        }
+        columns[key] = values;
+    }
+    return columns;
+}
+"""
+
+
+# Scrolls the grid down by one screen. Uses the given selector, or else the
+# largest scrollable element on the page. Returns false once it can't move.
+SCROLL_GRID = """
+(selector) => {
+    let grid = selector ? document.querySelector(selector) : null;
+    if (!grid) {
+        const scrollable = [...document.querySelectorAll('*')].filter(el =>
+            el.scrollHeight > el.clientHeight + 1 &&
+            ['auto', 'scroll'].includes(getComputedStyle(el).overflowY));
+        scrollable.sort((a, b) => b.scrollHeight - a.scrollHeight);
+        grid = scrollable[0];
+    }
+    if (!grid) {
+        return false;
+    }
+    const before = grid.scrollTop;
+    grid.scrollTop = before + grid.clientHeight;
+    return grid.scrollTop !== before;
+}
+"""
+
+
+class SessionLost(errors.PyppeteerError):
+    """The browser or page went away while a capture was running."""
+
+
+class BreakpointNotFound(errors.PyppeteerError):
+    """The report loaded without any script containing TARGET_BREAKPOINT."""
+
 
 class tbm_stats:
 
-    def __init__(self) -> None:
+    COLUMN_MAPPING = {
+        "inode-1qhQxZHBcWEVjKLrwXgiXq/CREATED_AT": "CreatedAt",
+        "inode-1qhQxZHBcWEVjKLrwXgiXq/ACCOUNT_ID": "AccountId",
+        "inode-1qhQxZHBcWEVjKLrwXgiXq/ACCOUNT_NAME": "AccountName",
+        "c6S8DJZnu2": "Balance"
+    }
+
+    def __init__(self, target_url: str = None, browser=None) -> None:
         self.all_results = []  # To store results from each debugger pause event
         self.output = pd.DataFrame()
         load_dotenv(override=True)
+        # Report to scrape, TARGET_URL unless given
+        self.target_url = target_url or os.getenv('TARGET_URL')
+        # Browser owned by fetch_reports() and shared with other reports; this instance only opens and closes its page
+        self.shared_browser = browser
+        # Maximum number of CDP requests outstanding at once while walking cellContent
+        self.max_in_flight = int(os.getenv('CDP_MAX_IN_FLIGHT', 16))
+        self.cdp_semaphore = asyncio.Semaphore(self.max_in_flight)
+        # 'walker' pulls cellContent with Runtime.getProperties, 'serialize' does it in one call
+        self.extraction_engine = os.getenv('EXTRACTION_ENGINE', 'walker')
+        # Overall deadline for one scrape attempt and how often to retry a failed one
+        self.scrape_timeout = float(os.getenv('SCRAPE_TIMEOUT', 30))
+        self.scrape_retries = int(os.getenv('SCRAPE_RETRIES', 1))
+        self.scrape_retry_delay = float(os.getenv('SCRAPE_RETRY_DELAY', 0.5))
+        # Seconds without a new script after the page loaded before giving up on finding the breakpoint
+        self.script_settle_timeout = float(os.getenv('SCRIPT_SETTLE_TIMEOUT', 1))
+        # Report column key -> our column name, from COLUMN_MAPPING or rediscovered when the report changes
+        self.column_mapping = ColumnMapping(load_column_mapping(self.COLUMN_MAPPING), os.getenv('COLUMN_MAPPING_CACHE', 'column_mapping.json'))
+        # Script URL -> resolved breakpoint location, reused while the bundle is unchanged
+        self.breakpoint_cache = BreakpointCache(os.getenv('BREAKPOINT_CACHE_FILE', 'breakpoints.json'))
+        # Only scripts whose URL matches this pattern are searched for TARGET_BREAKPOINT
+        self.script_url_pattern = re.compile(os.getenv('SCRIPT_URL_PATTERN', ''))
+        # Breakpoints placed by URL in the current browser session, keyed by script URL
+        self.placed_breakpoints = {}
+        # Script searches still running, and how many scripts have been parsed in this session
+        self.script_searches = set()
+        self.scripts_parsed = 0
+        # Candidate script URLs parsed during the current run, and whether one of them hit a breakpoint placed before it loaded
+        self.parsed_urls = set()
+        self.breakpoint_preplaced = False
+        # 'debugger' reads the paused grid, 'network' decodes the report's data query responses
+        self.capture_engine = os.getenv('CAPTURE_ENGINE', 'debugger')
+        self.network_query_pattern = re.compile(os.getenv('NETWORK_QUERY_PATTERN', 'query'))
+        # When set, every matched response body is saved here for offline decoding
+        self.network_record_dir = os.getenv('NETWORK_RECORD_DIR')
+        # requestId -> URL of data query responses that haven't finished loading
+        self.query_requests = {}
+        # Scroll the grid and merge every pause's rows instead of keeping only the visible ones
+        self.scroll_accumulate = (os.getenv('SCROLL_ACCUMULATE') == 'True')
+        self.grid_scroll_selector = os.getenv('GRID_SCROLL_SELECTOR', '')
+        self.scroll_settle_timeout = float(os.getenv('SCROLL_SETTLE_TIMEOUT', 3))
+        self.scroll_timeout = float(os.getenv('SCROLL_TIMEOUT', 300))
+        self.accumulated = pd.DataFrame()
+        self.pause_seen = None
+        # Record the CDP session to this file, or replay a recorded one instead of launching Chromium
+        self.cdp_record_file = os.getenv('CDP_RECORD_FILE')
+        self.cdp_replay_file = os.getenv('CDP_REPLAY_FILE')
+        self.cdp_replay_scale = float(os.getenv('CDP_REPLAY_SCALE', 1))
+        self.recorder = None
+        # Load profile: resource types (Image, Font, Stylesheet, Media..) and URL patterns the page loads without
+        self.block_resource_types = [t.strip() for t in os.getenv('BLOCK_RESOURCE_TYPES', '').split(',') if t.strip()]
+        self.block_url_patterns = [p.strip() for p in os.getenv('BLOCK_URL_PATTERNS', '').split(',') if p.strip()]
+        # Browser session, kept open between captures in watch()
+        self.browser = None
+        self.page = None
+        self.client = None
+        self.session_alive = False
+        # Completed by the CDP event handlers during a run of main()
+        self.breakpoint_set = None
+        self.output_ready = None
 
 
     def handle_script_parsed(self, client, payload):
-            asyncio.ensure_future(self.async_handle_script_parsed(client, payload))
+            self.scripts_parsed += 1
+            search = asyncio.ensure_future(self.async_handle_script_parsed(client, payload))
+            self.script_searches.add(search)
+            search.add_done_callback(self.script_searches.discard)
+
+    async def wait_for_breakpoint(self):
+        """
+        Wait until the breakpoint is set or every script has been searched without finding it.
+
+        Scripts can still be arriving after the load event, so this only gives up once all
+        searches have finished and no new script was parsed for SCRIPT_SETTLE_TIMEOUT seconds.
+        """
+        while not (self.breakpoint_set.done() or self.output_ready.done()):
+            parsed = self.scripts_parsed
+            if self.script_searches:
+                await asyncio.wait(self.script_searches)
+                continue
+            await asyncio.wait([self.breakpoint_set, self.output_ready], timeout=self.script_settle_timeout)
+            if self.scripts_parsed == parsed and not self.script_searches:
+                return
 
 
     async def async_handle_script_parsed(self, client, payload):
-        # Exit early is there is no URL
-        if (payload['url'] == ""):
+        url = payload['url']
+
+        # Exit early is there is no URL, or it can't be the report bundle
+        if (url == "") or not self.script_url_pattern.search(url):
+            return
+
+        script_hash = payload.get('hash')
+        self.parsed_urls.add(url)
+
+        placed = self.placed_breakpoints.get(url)
+        if placed:
+            if placed['hash'] == script_hash:
+                # Breakpoint already applied by URL and now resolved in this script, the pause comes on this load.
+                self.breakpoint_preplaced = True
+                self.resolve(self.breakpoint_set)
+                return
+
+            # The bundle changed since the breakpoint was placed, drop it and search again.
+            print(f"Script changed since breakpoint was cached: {url}")
+            del self.placed_breakpoints[url]
+            self.breakpoint_cache.remove(url)
+            try:
+                await client.send('Debugger.removeBreakpoint', {'breakpointId': placed['breakpointId']})
+            except errors.NetworkError as e:
+                print(f"INFO: Error removing stale breakpoint: {e}")
+
+        if (cached := self.breakpoint_cache.get(url, script_hash)) and not cached['location']:
+            # Searched before and the target isn't in this version of the script.
             return
-        
+
+        loc = cached['location'] if cached else await self.find_target_position(client, payload['scriptId'])
+        if loc is False:
+            self.breakpoint_cache.store(url, script_hash, None)
+
         # Search the file and proceed if target breakpoint is found
-        if (loc := await self.find_target_position(client, payload['scriptId'])):
-            
-            print(f"Script parsed: {payload['scriptId']} {payload['url']}")
+        if loc:
 
-            #line, col = find_target_position(client, payload['scriptId'])
+            print(f"Script parsed: {payload['scriptId']} {url}")
 
-            response = await client.send('Debugger.setBreakpoint', {
-            'location': {
-                'scriptId': payload['scriptId'],
-                'lineNumber': loc['line'],
-                'columnNumber': loc['col']
-                }
-            })
+            response = await self.set_breakpoint_by_url(client, url, script_hash, loc)
 
             print(f"Debugger response: {response}")
+            self.breakpoint_cache.store(url, script_hash, loc)
+            self.resolve(self.breakpoint_set)
+
+    async def set_breakpoint_by_url(self, client, url, script_hash, loc):
+        """Place a breakpoint that also applies to the script after every reload."""
+        response = await client.send('Debugger.setBreakpointByUrl', {
+            'url': url,
+            'lineNumber': loc['line'],
+            'columnNumber': loc['col']
+        })
+        self.placed_breakpoints[url] = {'breakpointId': response['breakpointId'], 'hash': script_hash}
+        return response
+
+    async def apply_cached_breakpoints(self, client):
+        """Place breakpoints before navigating for the cached bundles this report parsed in its last run."""
+        for url, loc in self.breakpoint_cache.locations(self.target_url).items():
+            script_hash = self.breakpoint_cache.entries[url]['hash']
+            try:
+                await self.set_breakpoint_by_url(client, url, script_hash, loc)
+            except errors.NetworkError as e:
+                print(f"INFO: Error applying cached breakpoint for {url}: {e}")
+
+        if self.placed_breakpoints:
+            print(f"Applied {len(self.placed_breakpoints)} cached breakpoint(s) before navigation")
 
 
     async def find_target_position(self, client, script_id):
+        """Return the target's location, False if the script doesn't contain it or None if the search failed."""
+        metrics.count('scripts_searched')
         try:
-            search_result = await client.send('Debugger.searchInContent', {
-                'scriptId': script_id,
-                'query': os.getenv('TARGET_BREAKPOINT')
-            })
+            with metrics.span('script_search'):
+                search_result = await client.send('Debugger.searchInContent', {
+                    'scriptId': script_id,
+                    'query': os.getenv('TARGET_BREAKPOINT')
+                })
         except errors.NetworkError as e:
             print(f"INFO: Error searching in content: {e}")
-            return False
+            return None
 
         if len(search_result['result']) == 0:
             return False
@@ -62,41 +275,50 @@ class tbm_stats:
 
         return {"line": line_number, "col": column_number}
 
+    async def send_limited(self, client, method, params=None):
+        """Send a CDP command, waiting for a free slot if too many are already in flight."""
+        async with self.cdp_semaphore:
+            return await client.send(method, params or {})
+
     async def fetch_properties_recursive(self, client, object_id, depth=0):
-        """Recursively fetch properties of an object by its objectId."""
+        """Recursively fetch properties of an object by its objectId.
+
+        Sibling objects are fetched concurrently, bounded by CDP_MAX_IN_FLIGHT. Every
+        object reached from the paused frame is in its "backtrace" object group, which
+        Debugger.resume releases in one go, so nothing is released per object.
+        """
         if depth > 5:  # Limiting recursion depth to prevent infinite loops
             return {}
 
-        properties_response = await client.send('Runtime.getProperties', {'objectId': object_id, 'ownProperties': True})
+        properties_response = await self.send_limited(client, 'Runtime.getProperties', {'objectId': object_id, 'ownProperties': True})
         properties_list = []
-        
-        for prop in properties_response.get('result', []):
+        pending = {}
+
+        for index, prop in enumerate(properties_response.get('result', [])):
             prop_value = prop.get('value', {}).get('value')
             prop_value_object_id = prop.get('value', {}).get('objectId')
 
             if prop_value_object_id:
-                prop_value = await self.fetch_properties_recursive(client, prop_value_object_id, depth=depth+1)
+                pending[index] = self.fetch_properties_recursive(client, prop_value_object_id, depth=depth+1)
 
             properties_list.append(prop_value)
 
+        if pending:
+            children = await asyncio.gather(*pending.values())
+            for index, child in zip(pending.keys(), children):
+                properties_list[index] = child
+
         return properties_list
 
     def handle_debugger_paused_sync(self, client, payload):
         asyncio.ensure_future(self.handle_debugger_paused(client, payload))
 
-    async def handle_debugger_paused(self, client, payload):
-
-        call_frames = payload.get('callFrames', [])
-        if not call_frames:
-            print("No call frames available.")
-            await client.send('Debugger.resume')
-            return
-        
+    async def extract_with_walker(self, client, this_id):
+        """Pull cellContent back with recursive Runtime.getProperties calls."""
         results = {}
+        cellContent_id = None
 
-        call_frame = call_frames[0]
-        object_id = call_frame['this']['objectId']
-        _this = await client.send('Runtime.getProperties', {'objectId': object_id, 'ownProperties': True})
+        _this = await client.send('Runtime.getProperties', {'objectId': this_id, 'ownProperties': True})
 
         # iterate through the 'this' to find the 'cellContent' objectid.
         if _this.get('result') and len(_this['result']) > 0:
@@ -106,28 +328,101 @@ class tbm_stats:
                     #print('found cellContent: ', record)
                     cellContent_id = record.get('value').get('objectId')
                     break
-            
-        else:
+
+        if cellContent_id is None:
             print('_this is not populated correctly')
-            await client.send('Debugger.resume')
-            return
+            return None
+
+        self.cdp_semaphore = asyncio.Semaphore(self.max_in_flight)
 
         cellContent_contents = await client.send('Runtime.getProperties', {'objectId': cellContent_id, 'ownProperties': True})
-        for contents in cellContent_contents['result']:
-            object_id = contents['value']['objectId']
-            properties = await self.fetch_properties_recursive(client, object_id)
-            results[contents['name']] = properties
+        columns = [contents for contents in cellContent_contents['result'] if contents.get('value', {}).get('objectId')]
+        properties = await asyncio.gather(*[
+            self.fetch_properties_recursive(client, contents['value']['objectId'])
+            for contents in columns
+        ])
+        for contents, column in zip(columns, properties):
+            results[contents['name']] = column
+
+        return results
+
+    async def extract_in_page(self, client, this_id, keys=None):
+        """
+        Serialize cellContent inside the page with a single Runtime.callFunctionOn.
+
+        Returns a columnar dict of {column key: [cell values]}, or None if the
+        paused frame has no cellContent or the call failed.
+        """
+        try:
+            response = await client.send('Runtime.callFunctionOn', {
+                'objectId': this_id,
+                'functionDeclaration': SERIALIZE_CELL_CONTENT,
+                'arguments': [{'value': keys}],
+                'returnByValue': True,
+                'silent': True
+            })
+        except errors.NetworkError as e:
+            print(f"INFO: Error serializing cellContent: {e}")
+            return None
+
+        if response.get('exceptionDetails'):
+            print(f"INFO: Exception serializing cellContent: {response['exceptionDetails'].get('text')}")
+            return None
 
-        res = self.transform_data(results)
+        return response.get('result', {}).get('value')
 
-        self.output = pd.DataFrame(res)
+    async def handle_debugger_paused(self, client, payload):
+
+        call_frames = payload.get('callFrames', [])
+        if not call_frames:
+            print("No call frames available.")
+            await client.send('Debugger.resume')
+            return
+
+        call_frame = call_frames[0]
+        object_id = call_frame['this']['objectId']
+
+        res = None
+        if self.extraction_engine == 'serialize':
+            with metrics.span('property_fetch'):
+                data = await self.extract_in_page(client, object_id, keys=list(self.column_mapping.mapping.keys()))
+            if data is not None and self.column_mapping.missing(data):
+                # The report's columns changed, serialize all of them once to find the new keys
+                with metrics.span('property_fetch'):
+                    data = await self.extract_in_page(client, object_id)
+                if data is not None:
+                    self.discover_columns(data, columnar=True)
+            if data is not None:
+                res = self.transform_data(data, columnar=True)
+            else:
+                print('Falling back to the property walker.')
+
+        if res is None:
+            with metrics.span('property_fetch'):
+                data = await self.extract_with_walker(client, object_id)
+            if data is None:
+                await client.send('Debugger.resume')
+                return
+            if self.column_mapping.missing(data):
+                self.discover_columns(data)
+            res = self.transform_data(data)
+
+        output = to_results_frame(res)
 
         # If the results are null values, break and run again.
-        if (self.output == 'null').all().all():
+        if output.isna().all().all():
             print("DataFrame contains only 'null' values! Running again..")
             await client.send('Debugger.resume')
             return
 
+        metrics.count('rows_extracted', len(output))
+        if self.scroll_accumulate:
+            self.accumulate(output)
+        else:
+            self.output = output
+
+        self.resolve(self.output_ready)
+
         # Resume debugger
         try:
             await client.send('Debugger.resume')
@@ -135,61 +430,485 @@ class tbm_stats:
             print(f"Error resuming debugger: {e}")
             
 
-    def transform_data(self, data):
-        mapping = {
-            "inode-1qhQxZHBcWEVjKLrwXgiXq/CREATED_AT": "CreatedAt",
-            "inode-1qhQxZHBcWEVjKLrwXgiXq/ACCOUNT_ID": "AccountId",
-            "inode-1qhQxZHBcWEVjKLrwXgiXq/ACCOUNT_NAME": "AccountName",
-            "c6S8DJZnu2": "Balance"
-        }
-
+    def discover_columns(self, data, columnar=False):
+        print(f"Report is missing columns {self.column_mapping.missing(data)}, discovering them..")
+        if self.column_mapping.discover(data, columnar):
+            metrics.count('column_mappings_discovered')
+
+    def accumulate(self, output):
+        """Merge the rows from one pause into the run's buffer, keyed by AccountId."""
+        before = len(self.accumulated)
+        rows = output[output['AccountId'].notna()]
+        merged = pd.concat([self.accumulated, rows], ignore_index=True) if before else rows
+        self.accumulated = merged.drop_duplicates('AccountId', keep='last').reset_index(drop=True)
+
+        self.output = to_results_frame(self.accumulated, typed=True)
+        print(f"Accumulated {len(self.accumulated) - before} new rows ({len(self.accumulated)} total)")
+        self.pause_seen.set()
+
+    async def scroll_until_complete(self, page):
+        """Scroll the grid a screen at a time until a scroll brings in no new rows."""
+        while True:
+            before = len(self.accumulated)
+            self.pause_seen.clear()
+
+            if not await page.evaluate(SCROLL_GRID, self.grid_scroll_selector):
+                print('Reached the end of the grid.')
+                return
+
+            try:
+                await asyncio.wait_for(self.pause_seen.wait(), self.scroll_settle_timeout)
+            except asyncio.TimeoutError:
+                print('No pause after scrolling, assuming every row has been seen.')
+                return
+
+            if len(self.accumulated) == before:
+                print('Scrolling brought in no new rows.')
+                return
+
+    def transform_data(self, data, columnar=False):
+        """
+        Map the report's internal column keys to our column names.
+
+        `data` is either the walker output, where every cell is a list of its
+        properties, or the columnar output of `extract_in_page` (columnar=True)
+        where every cell has already been reduced to its value.
+        """
         transformed_data = {}
-        for key, new_key in mapping.items():
+        for key, new_key in self.column_mapping.mapping.items():
             values = data.get(key, [])
-            transformed_values = [item[0] for item in values if isinstance(item, list)]
+            if columnar:
+                transformed_values = list(values)
+            else:
+                transformed_values = [item[0] for item in values if isinstance(item, list)]
             transformed_data[new_key] = transformed_values
 
+        # Pad columns missing from the report so the frame can still be built.
+        rows = max((len(values) for values in transformed_data.values()), default=0)
+        for values in transformed_data.values():
+            values.extend([None] * (rows - len(values)))
+
         return transformed_data
 
 
-    async def main(self):
-        browser = await launch(headless=True, devtools=True, executablePath=os.getenv('CHROME_DRIVER'))
-        page = await browser.newPage()
-        client: Connection = await page.target.createCDPSession()
+    def handle_response_received(self, payload):
+        """Remember the report's data query responses so their bodies can be read once loaded."""
+        if self.network_query_pattern.search(payload['response']['url']):
+            self.query_requests[payload['requestId']] = payload['response']['url']
 
-        await page.setViewport({'width': 1280, 'height': 800})
-        await page.setJavaScriptEnabled(True)
-        await page._client.send('Page.setBypassCSP', {'enabled': True})
+    def handle_loading_finished(self, client, payload):
+        if payload['requestId'] in self.query_requests:
+            asyncio.ensure_future(self.handle_query_response(client, payload['requestId']))
 
-        await client.send('Debugger.enable')
+    async def handle_query_response(self, client, request_id):
+        url = self.query_requests.pop(request_id)
+        try:
+            response = await client.send('Network.getResponseBody', {'requestId': request_id})
+        except errors.NetworkError as e:
+            print(f"INFO: Error reading response body for {url}: {e}")
+            return
 
-        client.on('Debugger.scriptParsed', lambda payload: self.handle_script_parsed(client, payload))
+        body = response.get('body', '')
+        if response.get('base64Encoded'):
+            body = base64.b64decode(body).decode('utf-8', errors='replace')
+
+        if self.network_record_dir:
+            os.makedirs(self.network_record_dir, exist_ok=True)
+            with open(os.path.join(self.network_record_dir, f"{request_id}.json"), 'w') as f:
+                f.write(body)
+
+        output = self.decode_response_body(body)
+        if output.empty or output.isna().all().all():
+            return
 
-        await page.goto(os.getenv('TARGET_URL'))
+        print(f"Captured {len(output)} rows from {url}")
+        metrics.count('rows_extracted', len(output))
+        self.output = output
+        self.resolve(self.output_ready)
 
-        # Wait for a short duration to ensure all scripts are parsed
-        await asyncio.sleep(3)
+    def decode_response_body(self, body: str) -> pd.DataFrame:
+        """
+        Decode a data query response into the results frame.
 
+        Accepts a JSON document or newline-delimited JSON. The report's column keys
+        are looked up anywhere in the document, either as columns ({key: [values]})
+        or as rows ([{key: value}, ...]). Returns an empty frame if none are found.
+        """
+        try:
+            documents = [json.loads(body)]
+        except ValueError:
+            documents = []
+            for line in body.splitlines():
+                try:
+                    documents.append(json.loads(line))
+                except ValueError:
+                    continue
+
+        for document in documents:
+            if (columns := self.find_report_columns(document)) is not None:
+                return to_results_frame(self.transform_data(columns, columnar=True))
+
+        return pd.DataFrame()
+
+    def find_report_columns(self, node, depth=0):
+        """Search a decoded response for the report's columns, returned as {key: [values]}."""
+        if depth > 10:
+            return None
+
+        keys = self.column_mapping.mapping.keys()
+        if isinstance(node, dict):
+            if any(isinstance(node.get(key), list) for key in keys):
+                return node
+            children = node.values()
+        elif isinstance(node, list):
+            rows = [row for row in node if isinstance(row, dict)]
+            if rows and any(key in rows[0] for key in keys):
+                return {key: [row.get(key) for row in rows] for key in keys}
+            children = node
+        else:
+            return None
+
+        for child in children:
+            if (columns := self.find_report_columns(child, depth + 1)) is not None:
+                return columns
+        return None
+
+    def decode_recorded_responses(self, directory: str) -> pd.DataFrame:
+        """Decode response bodies saved via NETWORK_RECORD_DIR, for working offline."""
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), 'r') as f:
+                output = self.decode_response_body(f.read())
+            if not output.empty:
+                return output
+        return pd.DataFrame()
+
+    def resolve(self, future, value=True):
+        """Complete one of the run's futures, ignoring futures from an earlier run."""
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    def reset_run(self):
+        """Prepare the output and futures for a new capture."""
+        loop = asyncio.get_event_loop()
+        self.output = pd.DataFrame()
+        self.breakpoint_set = loop.create_future()
+        self.output_ready = loop.create_future()
+        self.accumulated = pd.DataFrame()
+        self.pause_seen = asyncio.Event()
+        self.parsed_urls = set()
+        self.breakpoint_preplaced = False
+
+    def session_lost(self, reason):
+        """Mark the browser session dead and fail the capture that is waiting on it."""
+        if not self.session_alive:
+            # Already closing, e.g. the disconnect caused by close_session().
+            return
+        print(f"Browser session lost: {reason}")
+        self.session_alive = False
+        if self.output_ready is not None and not self.output_ready.done():
+            self.output_ready.set_exception(SessionLost(reason))
+
+    async def open_session(self):
+        """Launch Chromium (or use the shared browser) and attach a CDP session with the debugger handlers."""
+        if self.shared_browser is not None:
+            # fetch_reports() reports the shared browser disconnecting to every instance
+            self.browser = self.shared_browser
+            self.session_alive = True
+        else:
+            with metrics.span('browser_launch'):
+                self.browser = await launch_browser(self.cdp_replay_file, self.cdp_replay_scale)
+            self.session_alive = True
+            self.browser.on('disconnected', lambda: self.session_lost('browser disconnected'))
+
+        self.page = await self.browser.newPage()
+        self.page.on('error', lambda e: self.session_lost(f"target crashed: {e}"))
+        client: Connection = await self.page.target.createCDPSession()
+        self.client = client
+        self.count_cdp_calls(client)
+
+        if self.cdp_record_file:
+            self.recorder = CDPRecorder(self.cdp_record_file)
+            self.recorder.wrap(client)
+            self.recorder.wrap_page(self.page)
+
+        await self.page.setViewport({'width': 1280, 'height': 800})
+        await self.page.setJavaScriptEnabled(True)
+        await self.page._client.send('Page.setBypassCSP', {'enabled': True})
+        await self.apply_load_profile(client)
+
+        if self.capture_engine == 'network':
+            self.query_requests = {}
+            client.on('Network.responseReceived', self.handle_response_received)
+            client.on('Network.loadingFinished', lambda payload: self.handle_loading_finished(client, payload))
+            await client.send('Network.enable')
+            return
+
+        await client.send('Debugger.enable')
+
+        self.placed_breakpoints = {}
+        # Script searches still running, and how many scripts have been parsed in this session
+        self.script_searches = set()
+        self.scripts_parsed = 0
+        await self.apply_cached_breakpoints(client)
+
+        client.on('Debugger.scriptParsed', lambda payload: self.handle_script_parsed(client, payload))
         client.on('Debugger.paused', lambda payload: self.handle_debugger_paused_sync(client, payload))
 
-        await page.reload()
+    async def apply_load_profile(self, client):
+        """
+        Stop the page loading what data capture doesn't need.
 
-        await asyncio.sleep(10) 
+        Resource types are intercepted with the Fetch domain and failed before they are
+        sent. Unlike Page.setRequestInterception, this leaves the browser cache enabled,
+        so bundles still come from the disk cache in CHROME_USER_DATA_DIR.
+        """
+        try:
+            if self.block_url_patterns:
+                await client.send('Network.enable')
+                await client.send('Network.setBlockedURLs', {'urls': self.block_url_patterns})
+
+            if self.block_resource_types:
+                client.on('Fetch.requestPaused', lambda payload: asyncio.ensure_future(self.handle_request_paused(client, payload)))
+                await client.send('Fetch.enable', {'patterns': [
+                    {'resourceType': resource_type, 'requestStage': 'Request'} for resource_type in self.block_resource_types
+                ]})
+        except errors.NetworkError as e:
+            print(f"INFO: Error applying load profile: {e}")
+
+    async def handle_request_paused(self, client, payload):
+        metrics.count('requests_blocked')
+        try:
+            await client.send('Fetch.failRequest', {'requestId': payload['requestId'], 'errorReason': 'BlockedByClient'})
+        except errors.NetworkError as e:
+            print(f"INFO: Error blocking request: {e}")
+
+    def count_cdp_calls(self, client):
+        """Count every command sent through the session in the cdp_calls metric."""
+        send = client.send
+
+        async def counted_send(method, params=None):
+            metrics.count('cdp_calls')
+            return await send(method, params)
+
+        client.send = counted_send
+
+    async def close_session(self):
+        browser, self.browser = self.browser, None
+        page, self.page = self.page, None
+        self.session_alive = False
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if browser is None:
+            return
+        try:
+            if browser is not self.shared_browser:
+                await browser.close()
+            elif page is not None:
+                await page.close()
+        except Exception as e:
+            print(f"INFO: Error closing browser: {e}")
+
+    async def capture(self, page, reload=False):
+        """Load (or reload) the report and wait until a debugger pause has produced output."""
+        with metrics.span('page_load'):
+            if reload:
+                await page.reload()
+            else:
+                await page.goto(self.target_url)
+
+        if not self.output_ready.done() and self.capture_engine != 'network':
+            # A breakpoint only counts once a parsed script matched it, a cached one
+            # for a bundle that no longer loads never fires.
+            await self.wait_for_breakpoint()
+            if not (self.breakpoint_set.done() or self.output_ready.done()):
+                self.breakpoint_cache.record_run(self.target_url, self.parsed_urls)
+                # Fail now rather than waiting out SCRAPE_TIMEOUT for a pause that can't come
+                raise BreakpointNotFound(f"No script contained TARGET_BREAKPOINT ({self.scripts_parsed} parsed)")
+            # With a warm cache the breakpoint was placed before navigation and the
+            # pause arrives on this load. Otherwise it is usually placed after the
+            # grid code first ran, so reload once it is actually set.
+            if not (self.output_ready.done() or self.breakpoint_preplaced):
+                with metrics.span('page_load'):
+                    await page.reload()
+
+        with metrics.span('wait_for_output'):
+            await self.output_ready
+
+        if self.capture_engine != 'network':
+            self.breakpoint_cache.record_run(self.target_url, self.parsed_urls)
+
+    async def scroll(self, page):
+        """
+        Bring in the rest of a virtualized grid after capture() returned its first rows.
+
+        Runs outside the SCRAPE_TIMEOUT of a capture, large reports need many scrolls.
+        After SCROLL_TIMEOUT seconds the rows accumulated so far are kept.
+        """
+        if not self.scroll_accumulate or self.capture_engine == 'network':
+            return
+        with metrics.span('scroll'):
+            try:
+                await asyncio.wait_for(self.scroll_until_complete(page), self.scroll_timeout)
+            except asyncio.TimeoutError:
+                print(f"Scrolling took longer than {self.scroll_timeout}s, keeping the {len(self.accumulated)} rows seen so far.")
+                metrics.count('scroll_timeouts')
 
-        await browser.close()
+    async def main(self):
+        self.reset_run()
+        try:
+            await self.open_session()
+            with metrics.span('capture'):
+                await asyncio.wait_for(self.capture(self.page), self.scrape_timeout)
+            await self.scroll(self.page)
+        finally:
+            await self.close_session()
+
+    async def watch(self, interval, on_results):
+        """
+        Keep one browser open and capture the report every `interval` seconds.
+
+        `on_results` is called with each captured frame. The browser is relaunched
+        whenever the page crashes, the connection drops or a capture fails. Errors
+        raised by `on_results` are logged and leave the browser alone.
+        """
+        reload = False
+        while True:
+            try:
+                if not self.session_alive:
+                    await self.close_session()
+                    await self.open_session()
+                    reload = False
+
+                self.reset_run()
+                with metrics.span('capture'):
+                    await asyncio.wait_for(self.capture(self.page, reload=reload), self.scrape_timeout)
+                await self.scroll(self.page)
+                reload = True
+            except Exception as e:
+                print(f"Capture failed, restarting browser: {type(e).__name__} {e}")
+                metrics.count('scrape_failures')
+                await self.close_session()
+            else:
+                try:
+                    on_results(self.output)
+                except Exception as e:
+                    print(f"Failed to handle results: {type(e).__name__} {e}")
+
+            await asyncio.sleep(interval)
+
+    async def fetch_results(self) -> pd.DataFrame:
+        """Scrape the report, retrying failed attempts, for use inside a running event loop."""
+        for attempt in range(1, self.scrape_retries + 2):
+            try:
+                await self.main()
+            except (asyncio.TimeoutError, errors.PyppeteerError) as e:
+                print(f"Attempt {attempt} failed: {type(e).__name__} {e}")
+                metrics.count('scrape_failures')
+            else:
+                if (len(self.output) != 0):
+                    return self.output
+
+            if attempt <= self.scrape_retries:
+                await asyncio.sleep(self.scrape_retry_delay)
+
+        raise Exception("Failed to get results")
 
     def get_results(self) -> pd.DataFrame:
-        asyncio.get_event_loop().run_until_complete(self.main())
-        
-        if (len(self.output) != 0):
-            return self.output
+        return asyncio.get_event_loop().run_until_complete(self.fetch_results())
+
+
+async def launch_browser(replay_file: str = None, replay_scale: float = 1.0):
+    if replay_file:
+        print(f"Replaying CDP session from {replay_file}")
+        return ReplayBrowser.load(replay_file, replay_scale)
+
+    options = {'headless': True, 'devtools': True, 'executablePath': os.getenv('CHROME_DRIVER')}
+    if os.getenv('CHROME_USER_DATA_DIR'):
+        # A persistent profile keeps the disk cache, so warm runs don't download the bundles again
+        options['userDataDir'] = os.getenv('CHROME_USER_DATA_DIR')
+    return await launch(options)
+
+
+def report_file(filename: str, name: str) -> str:
+    """Per-report variant of `filename` for fetch_reports(), e.g. session.jsonl -> session-main.jsonl."""
+    root, ext = os.path.splitext(filename)
+    suffix = re.sub(r'[^\w.-]', '_', name)
+    return f"{root}-{suffix}{ext}"
+
+
+def load_targets() -> dict:
+    """Reports to scrape from TARGET_URLS (a JSON object of name -> URL), else TARGET_URL on its own."""
+    load_dotenv(override=True)
+    if os.getenv('TARGET_URLS'):
+        return json.loads(os.getenv('TARGET_URLS'))
+    return {'default': os.getenv('TARGET_URL')}
+
+
+async def fetch_reports(targets: dict, pool_size: int = None) -> dict:
+    """
+    Scrape several reports in one browser, at most `pool_size` pages at a time.
+
+    `targets` maps a report name to its URL. Every report gets its own tbm_stats,
+    page and CDP session, sharing the browser and breakpoint cache. Returns report
+    name -> results frame; reports still failing after their retries are left out.
+    """
+    pool_size = pool_size or int(os.getenv('REPORT_POOL_SIZE', 4))
+    pool = asyncio.Semaphore(pool_size)
+    browser = await launch_browser(os.getenv('CDP_REPLAY_FILE'), float(os.getenv('CDP_REPLAY_SCALE', 1)))
+    instances = {name: tbm_stats(url, browser) for name, url in targets.items()}
+
+    # Pages run concurrently, each records its own session next to CDP_RECORD_FILE, and
+    # reports can use different column keys, so each keeps its own COLUMN_MAPPING_CACHE
+    for name, instance in instances.items():
+        if instance.cdp_record_file:
+            instance.cdp_record_file = report_file(instance.cdp_record_file, name)
+        if instance.column_mapping.filename:
+            instance.column_mapping = ColumnMapping(instance.column_mapping.configured, report_file(instance.column_mapping.filename, name))
+
+    # One cache object, so reports don't overwrite each other's entries when saving
+    breakpoint_cache = next(iter(instances.values())).breakpoint_cache if instances else None
+    for instance in instances.values():
+        instance.breakpoint_cache = breakpoint_cache
+
+    browser.on('disconnected', lambda: [instance.session_lost('browser disconnected') for instance in instances.values()])
+
+    async def fetch(name, instance):
+        async with pool:
+            print(f"Scraping report {name}..")
+            return await instance.fetch_results()
+
+    try:
+        names = list(instances)
+        frames = await asyncio.gather(*(fetch(name, instances[name]) for name in names), return_exceptions=True)
+    finally:
+        for instance in instances.values():
+            instance.session_alive = False
+        try:
+            await browser.close()
+        except Exception as e:
+            print(f"INFO: Error closing browser: {e}")
+
+    results = {}
+    for name, frame in zip(names, frames):
+        if isinstance(frame, BaseException):
+            print(f"Report {name} failed: {type(frame).__name__} {frame}")
         else:
-            raise Exception("Failed to get results")
+            results[name] = frame
+    return results
+
+
+def get_reports(targets: dict = None, pool_size: int = None) -> dict:
+    return asyncio.get_event_loop().run_until_complete(fetch_reports(targets or load_targets(), pool_size))
 
 
 if __name__ == '__main__':
     instance = tbm_stats()
 
-    res = instance.get_results()
+    if len(sys.argv) > 1:
+        # Decode previously recorded network responses instead of scraping
+        res = instance.decode_recorded_responses(sys.argv[1])
+    else:
+        res = instance.get_results()
     
     print(res)
@@ -0,0 +1,51 @@
+import json
+
+from breakpoint_cache import BreakpointCache
+
+REPORT = 'https://report.invalid/a'
+OTHER_REPORT = 'https://report.invalid/b'
+LOCATION = {'line': 1, 'col': 2}
+
+
+def test_only_scripts_parsed_in_the_last_run_are_placed_before_navigation(tmp_path):
+    cache = BreakpointCache(str(tmp_path / 'breakpoints.json'))
+    cache.store('main.js', 'h1', LOCATION)
+    assert cache.locations(REPORT) == {}
+
+    cache.record_run(REPORT, {'main.js'})
+    assert cache.locations(REPORT) == {'main.js': LOCATION}
+    assert cache.locations(OTHER_REPORT) == {}
+
+    cache.record_run(REPORT, {'other.js'})
+    assert cache.locations(REPORT) == {}
+
+
+def test_scripts_no_report_parses_anymore_are_evicted(tmp_path):
+    filename = str(tmp_path / 'breakpoints.json')
+    cache = BreakpointCache(filename, max_missed=2)
+    cache.store('main.js', 'h1', LOCATION)
+    cache.record_run(REPORT, {'main.js'})
+    cache.record_run(OTHER_REPORT, {'main.js'})
+
+    for _ in range(2):
+        cache.record_run(REPORT, set())
+    # Still parsed by the other report
+    assert 'main.js' in cache.entries
+
+    for _ in range(2):
+        cache.record_run(OTHER_REPORT, set())
+    assert cache.entries == {}
+    with open(filename) as f:
+        assert json.load(f) == {}
+
+
+def test_entries_from_before_run_counting_are_not_placed_until_seen(tmp_path):
+    filename = tmp_path / 'breakpoints.json'
+    filename.write_text(json.dumps({'main.js': {'hash': 'h1', 'location': LOCATION}, 'gone.js': {'hash': 'h2', 'location': LOCATION}}))
+    cache = BreakpointCache(str(filename))
+    assert cache.locations(REPORT) == {}
+    assert cache.get('main.js', 'h1')['location'] == LOCATION
+
+    cache.record_run(REPORT, {'main.js'})
+    assert cache.locations(REPORT) == {'main.js': LOCATION}
+    assert 'gone.js' not in cache.entries
@@ -0,0 +1,227 @@
+import asyncio
+import contextlib
+import json
+import time
+
+import discord
+import pytest
+from aiohttp import web
+
+from discord_bot import DeliveryError, DiscordBot
+from metrics import metrics
+
+CHANNEL_ID = 4242
+
+
+def json_response(data, status: int = 200, headers: dict = None) -> web.Response:
+    # discord.py only decodes bodies whose content type is exactly application/json
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={**(headers or {}), 'Content-Type': 'application/json'})
+
+
+class FakeDiscord:
+    """
+    Local stand-in for the Discord REST API: the routes the bot uses to post, edit and delete.
+
+    `failures` maps (method, content or message id) to a list of (status, headers) answered
+    before the request is handled normally, one per attempt.
+    """
+
+    def __init__(self) -> None:
+        self.messages = {}
+        self.next_id = 1000
+        self.requests = []
+        self.failures = {}
+        app = web.Application()
+        app.router.add_get('/api/v10/users/@me', self.me)
+        app.router.add_post('/api/v10/channels/{channel}/messages', self.create)
+        app.router.add_get('/api/v10/channels/{channel}/messages/{message}', self.fetch)
+        app.router.add_patch('/api/v10/channels/{channel}/messages/{message}', self.edit)
+        app.router.add_delete('/api/v10/channels/{channel}/messages/{message}', self.delete)
+        self.runner = web.AppRunner(app)
+
+    async def start(self) -> str:
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/api/v10"
+
+    def message(self, message_id: int) -> dict:
+        return {
+            'id': str(message_id), 'channel_id': str(CHANNEL_ID), 'type': 0,
+            'content': self.messages[message_id],
+            'author': {'id': '1', 'username': 'bot', 'discriminator': '0', 'avatar': None},
+            'timestamp': '2023-09-01T00:00:00+00:00', 'edited_timestamp': None,
+            'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [],
+            'attachments': [], 'embeds': [], 'pinned': False
+        }
+
+    def failure(self, method: str, key):
+        queued = self.failures.get((method, key))
+        if queued:
+            status, headers = queued.pop(0)
+            return json_response({'message': 'fake failure', 'code': 0}, status=status, headers=headers)
+        return None
+
+    async def me(self, request):
+        return json_response({'id': '1', 'username': 'bot', 'discriminator': '0', 'avatar': None, 'bot': True})
+
+    async def create(self, request):
+        content = (await request.json())['content']
+        self.requests.append(('POST', content))
+        if (failed := self.failure('POST', content)) is not None:
+            return failed
+        self.next_id += 1
+        self.messages[self.next_id] = content
+        return json_response(self.message(self.next_id))
+
+    async def fetch(self, request):
+        message_id = int(request.match_info['message'])
+        self.requests.append(('GET', message_id))
+        if message_id not in self.messages:
+            return json_response({'message': 'Unknown Message', 'code': 10008}, status=404)
+        return json_response(self.message(message_id))
+
+    async def edit(self, request):
+        message_id = int(request.match_info['message'])
+        self.requests.append(('PATCH', message_id))
+        if (failed := self.failure('PATCH', message_id)) is not None:
+            return failed
+        self.messages[message_id] = (await request.json())['content']
+        return json_response(self.message(message_id))
+
+    async def delete(self, request):
+        message_id = int(request.match_info['message'])
+        self.requests.append(('DELETE', message_id))
+        self.messages.pop(message_id, None)
+        return web.Response(status=204)
+
+    def methods(self) -> list:
+        return [method for method, _ in self.requests]
+
+
+@pytest.fixture
+def environment(tmp_path, monkeypatch):
+    monkeypatch.setenv('MEMBER_DIRECTORY_DB', str(tmp_path / 'members.sqlite'))
+    monkeypatch.setenv('LEADERBOARD_MESSAGE_FILE', str(tmp_path / 'message.json'))
+    monkeypatch.setenv('DISCORD_MAX_RETRIES', '2')
+    return tmp_path
+
+
+@contextlib.asynccontextmanager
+async def connected(monkeypatch):
+    """A logged in DiscordBot talking to a FakeDiscord, without a gateway connection."""
+    fake = FakeDiscord()
+    monkeypatch.setattr(discord.http.Route, 'BASE', await fake.start())
+    bot = DiscordBot()
+    # Only the REST session, login() would also fetch the application
+    await bot.http.static_login('token')
+    bot.get_channel = bot.get_partial_messageable
+    try:
+        yield fake, bot
+    finally:
+        await bot.http.close()
+        await fake.runner.cleanup()
+
+
+def saved_ids(environment) -> list:
+    with open(environment / 'message.json') as f:
+        return json.load(f)[str(CHANNEL_ID)]
+
+
+def test_rate_limited_chunk_is_retried_after_retry_after(environment, monkeypatch):
+    async def scenario():
+        async with connected(monkeypatch) as (fake, bot):
+            fake.failures[('POST', 'one\n')] = [(429, {'Retry-After': '0.3'})]
+            limited = metrics.counters['discord_rate_limited']
+
+            start = time.perf_counter()
+            results = await bot.send_message_async(['one\n', 'two\n'], channel_id=CHANNEL_ID)
+
+            assert time.perf_counter() - start >= 0.3
+            assert fake.requests == [('POST', 'one\n'), ('POST', 'one\n'), ('POST', 'two\n')]
+            assert [result.error for result in results] == [None, None]
+            assert metrics.counters['discord_rate_limited'] == limited + 1
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_retries_are_bounded(environment, monkeypatch):
+    async def scenario():
+        async with connected(monkeypatch) as (fake, bot):
+            fake.failures[('POST', 'one\n')] = [(429, {'Retry-After': '0'})] * 5
+
+            with pytest.raises(DeliveryError) as raised:
+                await bot.send_message_async(['one\n'], channel_id=CHANNEL_ID)
+
+            # DISCORD_MAX_RETRIES=2: the first attempt and two retries
+            assert fake.methods() == ['POST'] * 3
+            assert raised.value.results[0].error.status == 429
+
+    asyncio.run(scenario())
+
+
+def test_failed_chunk_raises_delivery_error_after_sending_the_rest(environment, monkeypatch):
+    async def scenario():
+        async with connected(monkeypatch) as (fake, bot):
+            fake.failures[('POST', 'two\n')] = [(403, {})]
+
+            with pytest.raises(DeliveryError) as raised:
+                await bot.send_message_async(['one\n', 'two\n', 'three\n'], channel_id=CHANNEL_ID)
+
+            results = raised.value.results
+            assert [result.index for result in results] == [0, 1, 2]
+            assert isinstance(results[1].error, discord.Forbidden)
+            assert results[0].error is None and results[2].error is None
+            assert sorted(fake.messages.values()) == ['one\n', 'three\n']
+            # Only the delivered chunks are remembered for editing
+            assert saved_ids(environment) == [results[0].message.id, results[2].message.id]
+
+    asyncio.run(scenario())
+
+
+def test_edit_in_place_updates_the_posted_messages(environment, monkeypatch):
+    async def scenario():
+        async with connected(monkeypatch) as (fake, bot):
+            first = await bot.send_message_async(['one\n', 'two\n'], edit=True, channel_id=CHANNEL_ID)
+            posted = [result.message.id for result in first]
+            fake.requests.clear()
+
+            second = await bot.send_message_async(['uno\n', 'dos\n'], edit=True, channel_id=CHANNEL_ID)
+
+            assert 'POST' not in fake.methods()
+            assert [result.message.id for result in second] == posted
+            assert [fake.messages[message_id] for message_id in posted] == ['uno\n', 'dos\n']
+            assert saved_ids(environment) == posted
+
+    asyncio.run(scenario())
+
+
+def test_edit_in_place_posts_again_when_the_old_message_is_gone(environment, monkeypatch):
+    async def scenario():
+        async with connected(monkeypatch) as (fake, bot):
+            first = await bot.send_message_async(['one\n'], edit=True, channel_id=CHANNEL_ID)
+            del fake.messages[first[0].message.id]
+
+            second = await bot.send_message_async(['uno\n'], edit=True, channel_id=CHANNEL_ID)
+
+            assert second[0].message.id != first[0].message.id
+            assert saved_ids(environment) == [second[0].message.id]
+
+    asyncio.run(scenario())
+
+
+def test_shorter_leaderboard_deletes_leftover_messages(environment, monkeypatch):
+    async def scenario():
+        async with connected(monkeypatch) as (fake, bot):
+            first = await bot.send_message_async(['one\n', 'two\n', 'three\n'], edit=True, channel_id=CHANNEL_ID)
+            posted = [result.message.id for result in first]
+            fake.requests.clear()
+
+            await bot.send_message_async(['uno\n'], edit=True, channel_id=CHANNEL_ID)
+
+            assert ('DELETE', posted[1]) in fake.requests and ('DELETE', posted[2]) in fake.requests
+            assert fake.messages == {posted[0]: 'uno\n'}
+            assert saved_ids(environment) == [posted[0]]
+
+    asyncio.run(scenario())
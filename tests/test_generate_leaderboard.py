@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+from results_schema import to_results_frame
+
+# Expected boards are the output of the original merge-based generate_leaderboard for the same inputs
+
+RESULTS = {
+    'CreatedAt': ['2023-09-01 10:00:00'] * 6,
+    'AccountId': ['1', '2', '3', '4', '5', '6'],
+    'AccountName': ['EXPRESS1001', 'EXPRESS1002', 'EXPRESS1003', 'EXPRESS1004', 'EXPRESS1005', 'EXPRESS1006'],
+    'Balance': ['$51,250.00', '$49,312.55', '$50,000.10', '$52,480.75', '$1,234.50', '$48,999.99']
+}
+
+# Discord members for the format 1 usernames alice and bob
+MEMBERS = pd.DataFrame({'id': [111, 222], 'name': ['Alice', 'bob']})
+
+# Mixed case accounts, an express account on a row and on the dummy row, an account that
+# wasn't scraped, a username with whitespace and a #discriminator and one without a username
+LOOKUP_BASIC = pd.DataFrame({
+    0: ['express1001', 'Express1002', 'EXPRESS1003', 'express1004', 'express9999', 'dummy'],
+    1: ['alice', ' Bob#1234', 'carol', np.nan, 'dave', 'erin'],
+    2: ['', np.nan, 'express1005', '', '', 'express1006']
+})
+
+BOARD_BASIC = '\n'.join([
+    '                   **PnL** **Member**',
+    ':first_place:   $48,999.99       erin',
+    ':second_place:   $2,480.75       1004',
+    ':third_place:    $1,250.00     <@111>',
+    '4                $1,234.60      carol',
+    '5                 $-687.45     <@222>'
+])
+
+# User ID '0' is a member without a Discord account
+LOOKUP_UNPACKED = pd.DataFrame({
+    'User ID': ['111', '0', '333', '444', '555', '666'],
+    'User Name': ['alice', 'bob', 'carol', 'dan', 'dave', 'erin'],
+    'Accounts': ['EXPRESS1001', 'express1002', 'Express1003', 'EXPRESS1004', 'EXPRESS9999', 'dummy'],
+    'ExpressAccountName': [np.nan, np.nan, 'EXPRESS1005', np.nan, np.nan, 'EXPRESS1006'],
+    'TotalAccounts': 1
+})
+
+BOARD_UNPACKED = '\n'.join([
+    '                   **PnL** **Member**',
+    ':first_place:   $48,999.99     <@666>',
+    ':second_place:   $2,480.75     <@444>',
+    ':third_place:    $1,250.00     <@111>',
+    '4                $1,234.60     <@333>',
+    '5                 $-687.45        NaN'
+])
+
+
+@pytest.mark.parametrize('lookup, lookup_format, board', [
+    (LOOKUP_BASIC, 1, BOARD_BASIC),
+    (LOOKUP_UNPACKED, 2, BOARD_UNPACKED)
+])
+def test_board_matches_the_merge_based_output(lookup, lookup_format, board):
+    results = to_results_frame(RESULTS)
+    inputs = (results.copy(), lookup.copy(), MEMBERS.copy())
+
+    assert utils.generate_leaderboard(results, lookup, MEMBERS, lookup_format) == board
+    # The inputs are left as they were
+    for before, after in zip(inputs, (results, lookup, MEMBERS)):
+        pd.testing.assert_frame_equal(before, after)
+
+
+def test_no_scraped_accounts_gives_no_board():
+    results = to_results_frame({column: [] for column in RESULTS})
+    lookup = LOOKUP_BASIC[LOOKUP_BASIC[0] != 'dummy']
+
+    assert utils.generate_leaderboard(results, lookup, MEMBERS, 1) is False
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from change_tracker import RowHashStore
+from leaderboard_index import LeaderboardIndex
+from results_schema import to_results_frame
+
+ACCOUNTS = 60
+
+
+def make_lookup(rng, lookup_format: int) -> pd.DataFrame:
+    """Lookup rows for most accounts, some with an express account, some naming accounts not scraped yet."""
+    names = [f"EXPRESS{i}" for i in rng.permutation(ACCOUNTS + 10)]
+    express = [f"EXPRESS{rng.integers(ACCOUNTS + 10)}" if rng.random() < 0.3 else np.nan for _ in names]
+    # The same account on two rows
+    names[1] = names[0]
+    if lookup_format == 1:
+        return pd.DataFrame({0: names, 1: [f"user{i}" for i in range(len(names))], 2: express})
+    return pd.DataFrame({'Accounts': names, 'ExpressAccountName': express, 'User ID': [str(10 ** 17 + i) for i in range(len(names))]})
+
+
+def make_results(rng) -> pd.DataFrame:
+    # Balances on a coarse grid so ties are common
+    return to_results_frame({
+        'AccountId': np.arange(ACCOUNTS),
+        'AccountName': [f"EXPRESS{i}" for i in range(ACCOUNTS)],
+        'Balance': rng.integers(45, 55, ACCOUNTS) * 1000
+    })
+
+
+def step(rng, results: pd.DataFrame, number: int) -> pd.DataFrame:
+    """Change a few balances and now and then blank, remove, add or duplicate an account."""
+    results = results.copy()
+    changed = rng.choice(len(results), rng.integers(1, 8), replace=False)
+    results.loc[changed, 'Balance'] = rng.integers(45, 55, len(changed)) * 100000
+    if number % 4 == 0:
+        results.loc[changed[:1], 'Balance'] = pd.NA
+    if number % 5 == 0:
+        results = results.drop(results.index[rng.integers(len(results))])
+    if number % 3 == 0:
+        # An account the lookup knows but that wasn't scraped before
+        account = ACCOUNTS + number % 10
+        added = {'AccountId': [1000 + number], 'AccountName': [f"EXPRESS{account}"], 'Balance': [rng.integers(45, 55) * 100000]}
+        results = pd.concat([results, to_results_frame(added)], ignore_index=True)
+    if number % 7 == 0:
+        # A second row for an existing account name
+        duplicate = results.iloc[[rng.integers(len(results))]].assign(AccountId=2000 + number, Balance=rng.integers(45, 55) * 100000)
+        results = pd.concat([results, duplicate], ignore_index=True)
+    return to_results_frame(results.reset_index(drop=True), typed=True)
+
+
+@pytest.mark.parametrize('lookup_format', [1, 2])
+@pytest.mark.parametrize('seed', range(3))
+def test_incremental_rank_matches_a_full_rank(lookup_format, seed):
+    rng = np.random.default_rng(seed)
+    lookup = make_lookup(rng, lookup_format)
+    results = make_results(rng)
+    store = RowHashStore(':memory:')
+    store.commit(results)
+
+    incremental = LeaderboardIndex(lookup, None, lookup_format=lookup_format)
+    incremental.rank(results, top_n=10)
+
+    for number in range(30):
+        results = step(rng, results, number)
+        changes = store.diff(results)
+        store.commit(results)
+        top_n = [None, 5, 20][number % 3]
+
+        expected = LeaderboardIndex(lookup, None, lookup_format=lookup_format).rank(results, top_n=top_n)
+        pd.testing.assert_frame_equal(incremental.rank(results, changes, top_n=top_n), expected)
+
+
+def test_tied_rows_keep_lookup_order_when_moved():
+    lookup = pd.DataFrame({0: ['a', 'b', 'c', 'd'], 1: ['ua', 'ub', 'uc', 'ud']})
+    results = to_results_frame({'AccountId': [1, 2, 3, 4], 'AccountName': ['A', 'B', 'C', 'D'], 'Balance': [51000, 50000, 51000, 50000]})
+    store = RowHashStore(':memory:')
+    store.commit(results)
+    index = LeaderboardIndex(lookup, None)
+    assert index.rank(results)['Account'].tolist() == ['a', 'c', 'b', 'd']
+
+    results = to_results_frame({'AccountId': [1, 2, 3, 4], 'AccountName': ['A', 'B', 'C', 'D'], 'Balance': [50000, 51000, 51000, 50000]})
+    assert index.rank(results, store.diff(results))['Account'].tolist() == ['b', 'c', 'a', 'd']
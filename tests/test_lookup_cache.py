@@ -0,0 +1,121 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import lookup_cache
+from lookup_cache import LookupCache
+
+SHEETS = {
+    1: b"EXPRESS000001,alice,EXPRESS000009\nEXPRESS000002,bob,\n",
+    2: b'User ID,User Name,Accounts,TotalAccounts\n101,alice,"[\'EXPRESS000001\', \'EXPRESS000002\']",2\n0,bob,"[\'EXPRESS000003\']",1\n'
+}
+
+
+class SheetHandler(BaseHTTPRequestHandler):
+    """Serves server.body, with an ETag and Last-Modified unless server.validators is False."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        etag = f'"{hashlib.md5(server.body).hexdigest()}"'
+
+        if server.validators and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(server.body)))
+        if server.validators:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', 'Sat, 02 Sep 2023 10:00:00 GMT')
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def sheet_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SheetHandler)
+    server.body = b''
+    server.validators = True
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/sheet.csv"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Count calls to parse_lookup."""
+    calls = []
+    parse = lookup_cache.parse_lookup
+
+    def counting(body, sheet_type):
+        calls.append(sheet_type)
+        return parse(body, sheet_type)
+
+    monkeypatch.setattr(lookup_cache, 'parse_lookup', counting)
+    return calls
+
+
+@pytest.mark.parametrize('sheet_type', [1, 2])
+def test_unchanged_sheet_is_a_304_and_not_parsed(tmp_path, sheet_server, parses, sheet_type):
+    sheet_server.body = SHEETS[sheet_type]
+    cache = LookupCache(str(tmp_path))
+
+    first = cache.get(sheet_server.url, sheet_type)
+    second = cache.get(sheet_server.url, sheet_type)
+
+    assert parses == [sheet_type]
+    assert 'If-None-Match' not in sheet_server.requests[0]
+    assert sheet_server.requests[1]['If-None-Match'].startswith('"')
+    assert sheet_server.requests[1]['If-Modified-Since'] == 'Sat, 02 Sep 2023 10:00:00 GMT'
+    pd.testing.assert_frame_equal(first, second, check_dtype=False)
+
+
+@pytest.mark.parametrize('sheet_type', [1, 2])
+def test_same_body_without_validators_is_not_parsed(tmp_path, sheet_server, parses, sheet_type):
+    sheet_server.body = SHEETS[sheet_type]
+    sheet_server.validators = False
+    cache = LookupCache(str(tmp_path))
+
+    first = cache.get(sheet_server.url, sheet_type)
+    second = cache.get(sheet_server.url, sheet_type)
+
+    assert len(sheet_server.requests) == 2
+    assert parses == [sheet_type]
+    pd.testing.assert_frame_equal(first, second, check_dtype=False)
+
+
+@pytest.mark.parametrize('sheet_type', [1, 2])
+def test_changed_sheet_is_downloaded_and_parsed_again(tmp_path, sheet_server, parses, sheet_type):
+    sheet_server.body = SHEETS[sheet_type]
+    cache = LookupCache(str(tmp_path))
+    cache.get(sheet_server.url, sheet_type)
+
+    sheet_server.body = SHEETS[sheet_type].replace(b'bob', b'carol')
+    lookup = cache.get(sheet_server.url, sheet_type)
+
+    assert parses == [sheet_type, sheet_type]
+    assert 'carol' in lookup.astype(str).to_numpy()
+    assert 'bob' not in lookup.astype(str).to_numpy()
+
+
+def test_parsed_lookup_shapes():
+    first = lookup_cache.parse_lookup(SHEETS[1], 1)
+    assert list(first.columns) == [0, 1, 2]
+    assert first[1].tolist() == ['alice', 'bob']
+
+    second = lookup_cache.parse_lookup(SHEETS[2], 2)
+    assert second['Accounts'].tolist() == ['EXPRESS000001', 'EXPRESS000002', 'EXPRESS000003']
+    assert second['User ID'].tolist() == [101, 101, 0]
@@ -0,0 +1,58 @@
+import sqlite3
+import time
+from types import SimpleNamespace
+
+from member_directory import MemberDirectory
+
+GUILD = SimpleNamespace(id=7)
+
+
+def member(member_id: int, name: str, global_name: str = None, nick: str = None):
+    return SimpleNamespace(id=member_id, name=name, global_name=global_name, nick=nick, guild=GUILD)
+
+
+def test_members_not_seen_within_the_ttl_are_stale(tmp_path):
+    directory = MemberDirectory(str(tmp_path / 'members.sqlite'), hit_ttl=60)
+    directory.upsert(member(1, 'alice'))
+    directory.upsert(member(2, 'bob'))
+    directory.conn.execute('UPDATE members SET seen_at = ? WHERE id = 2', (time.time() - 120,))
+
+    assert directory.stale({'alice', 'bob', 'carol'}, GUILD.id) == ['bob']
+    # Stale members still resolve until they are looked up again
+    assert directory.unresolved({'alice', 'bob'}, GUILD.id) == set()
+
+
+def test_forgotten_names_are_unresolved(tmp_path):
+    directory = MemberDirectory(str(tmp_path / 'members.sqlite'))
+    directory.upsert(member(1, 'alice'))
+    directory.forget('alice', GUILD.id)
+
+    assert directory.unresolved({'alice'}, GUILD.id) == {'alice'}
+
+
+def test_user_update_renames_the_member_in_every_guild(tmp_path):
+    directory = MemberDirectory(str(tmp_path / 'members.sqlite'))
+    directory.upsert(member(1, 'alice', nick='Al'))
+    directory.upsert(SimpleNamespace(id=1, name='alice', global_name=None, nick=None, guild=SimpleNamespace(id=8)))
+
+    directory.update_user(SimpleNamespace(id=1, name='alicia', global_name='Alicia'))
+
+    for guild_id in (7, 8):
+        assert directory.find({'alice'}, guild_id).empty
+        assert directory.find({'alicia'}, guild_id)[['name', 'global_name']].values.tolist() == [['alicia', 'Alicia']]
+
+
+def test_members_cached_without_seen_at_are_stale(tmp_path):
+    filename = str(tmp_path / 'members.sqlite')
+    conn = sqlite3.connect(filename)
+    conn.execute('''CREATE TABLE members (guild_id INTEGER, id INTEGER, name TEXT, global_name TEXT, nick TEXT,
+        name_key TEXT, global_name_key TEXT, nick_key TEXT, PRIMARY KEY (guild_id, id))''')
+    conn.execute('CREATE TABLE misses (guild_id INTEGER, name_key TEXT, searched_at REAL, PRIMARY KEY (guild_id, name_key))')
+    conn.execute("INSERT INTO members VALUES (7, 1, 'alice', NULL, NULL, 'alice', NULL, NULL)")
+    conn.commit()
+    conn.close()
+
+    directory = MemberDirectory(filename)
+    assert directory.stale({'alice'}, GUILD.id) == ['alice']
+    directory.upsert(member(1, 'alice'))
+    assert directory.stale({'alice'}, GUILD.id) == []
@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from results_schema import to_results_frame
+from tbm_stats import tbm_stats
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'network')
+
+
+@pytest.fixture
+def scraper(tmp_path, monkeypatch):
+    monkeypatch.setenv('COLUMN_MAPPING', '')
+    monkeypatch.setenv('COLUMN_MAPPING_CACHE', '')
+    monkeypatch.setenv('BREAKPOINT_CACHE_FILE', str(tmp_path / 'breakpoints.json'))
+    return tbm_stats('http://report.invalid')
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), 'r') as f:
+        return f.read()
+
+
+def assert_results(output: pd.DataFrame):
+    assert list(output.columns) == ['CreatedAt', 'AccountId', 'AccountName', 'Balance']
+    assert str(output['AccountId'].dtype) == 'Int64'
+    assert str(output['Balance'].dtype) == 'Int64'
+    assert isinstance(output['AccountName'].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_datetime64_any_dtype(output['CreatedAt'])
+
+    assert output['AccountId'].tolist() == [104211, 104377, 104502, 104618]
+    assert output['AccountName'].astype(str).tolist() == ['EXPRESS104211', 'EXPRESS104377', 'EXPRESS104502', 'EXPRESS104618']
+    # Balances are cents, the report's 'null' is missing
+    assert output['Balance'].tolist()[:2] == [5125000, 4931255]
+    assert output['Balance'].isna().tolist() == [False, False, True, False]
+    assert output['CreatedAt'].iloc[0] == pd.Timestamp('2023-09-01 14:02:11')
+
+
+@pytest.mark.parametrize('name', ['columnar.json', 'rows.ndjson'])
+def test_recorded_body_decodes_to_the_typed_results_frame(scraper, name):
+    assert_results(scraper.decode_response_body(read_fixture(name)))
+
+
+def test_columnar_shape_is_found_nested_in_the_document(scraper):
+    columns = scraper.find_report_columns(json.loads(read_fixture('columnar.json')))
+    assert set(scraper.COLUMN_MAPPING) <= set(columns)
+
+
+def test_row_list_shape_is_turned_into_columns(scraper):
+    lines = [json.loads(line) for line in read_fixture('rows.ndjson').splitlines()]
+    columns = scraper.find_report_columns(lines[1])
+    assert list(columns) == list(scraper.COLUMN_MAPPING)
+    assert columns['c6S8DJZnu2'] == ['$51,250.00', '$49,312.55', 'null', '$50,000.00']
+
+
+def test_body_without_the_report_columns_decodes_to_an_empty_frame(scraper):
+    assert scraper.decode_response_body(read_fixture('no_report.json')).empty
+
+
+def test_recorded_directory_skips_unrelated_responses(scraper, tmp_path):
+    recorded = tmp_path / 'recorded'
+    recorded.mkdir()
+    shutil.copy(os.path.join(FIXTURES, 'no_report.json'), recorded / '1000.1.json')
+    shutil.copy(os.path.join(FIXTURES, 'rows.ndjson'), recorded / '1000.2.json')
+
+    assert_results(scraper.decode_recorded_responses(str(recorded)))
+
+
+@pytest.mark.parametrize('balances, cents', [
+    ([51250, 49312, 50000, 50000], [5125000, 4931200, 5000000, 5000000]),
+    ([50000.5, 49000, 50000, 50000], [5000050, 4900000, 5000000, 5000000]),
+])
+def test_numeric_balances_are_dollars_whatever_their_dtype(scraper, balances, cents):
+    document = json.loads(read_fixture('columnar.json'))
+    document['result']['data']['c6S8DJZnu2'] = balances
+
+    output = scraper.decode_response_body(json.dumps(document))
+
+    assert output['Balance'].tolist() == cents
+
+
+def test_typed_frame_passes_through_with_balances_kept_as_cents(scraper):
+    output = scraper.decode_response_body(read_fixture('columnar.json'))
+
+    assert_results(to_results_frame(output, typed=True))